@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from collections.abc import Callable
+from datetime import datetime
+from threading import Lock
+from typing import Any
+
+
+class JobRegistry:
+    """Bounded registry of async dashboard runs.
+
+    Runs are kept in least-recently-used order. Creating, polling or
+    appending to a run moves it to the back. Every write first sweeps runs
+    idle for longer than ``ttl`` seconds off the front, then drops the
+    oldest runs until at most ``max_runs`` remain. Each result is passed
+    through ``render_tile`` once, when it arrives, and only the encoded tile
+    is stored. Polls and streams then slice and join bytes, and a run never
+    holds more than its rendered tiles.
+
+    Each run carries an ``asyncio.Event`` that is set and replaced whenever
+    a result arrives or the run is evicted, so streams can await the next
+    tile with ``wait_for_change`` instead of polling. Results must be
+    appended from the event loop thread (``TimerScheduler`` callbacks are).
+    """
+
+    def __init__(
+        self,
+        render_tile: Callable[[dict[str, Any]], bytes],
+        max_runs: int = 1000,
+        ttl: float = 600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.lock = Lock()
+        self.max_runs = max_runs
+        self.ttl = ttl
+        self._render_tile = render_tile
+        self._clock = clock
+        self._runs: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._evictions = {"expired": 0, "capacity": 0}
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def create(self, total: int) -> str:
+        run_id = str(uuid.uuid4())
+        with self.lock:
+            now = self._clock()
+            self._evict(now)
+            self._runs[run_id] = {
+                "created": datetime.now(),
+                "last_seen": now,
+                "total": total,
+                "tiles": [],
+                "changed": asyncio.Event(),
+            }
+            while len(self._runs) > self.max_runs:
+                _, evicted = self._runs.popitem(last=False)
+                evicted["changed"].set()
+                self._evictions["capacity"] += 1
+        return run_id
+
+    def get(self, run_id: str) -> dict[str, Any] | None:
+        with self.lock:
+            self._evict(self._clock())
+            run = self._touch(run_id)
+            if run is None:
+                return None
+            return {**run, "tiles": list(run["tiles"])}
+
+    def append_result(self, run_id: str, payload: dict[str, Any]) -> bool:
+        tile = self._render_tile(payload)
+        with self.lock:
+            self._evict(self._clock())
+            run = self._touch(run_id)
+            if run is None:
+                return False
+            run["tiles"].append(tile)
+            changed, run["changed"] = run["changed"], asyncio.Event()
+        changed.set()
+        return True
+
+    async def wait_for_change(self, run_id: str, seen: int, timeout: float) -> bool:
+        with self.lock:
+            run = self._runs.get(run_id)
+            if run is None or len(run["tiles"]) > seen or len(run["tiles"]) >= run["total"]:
+                return True
+            changed = run["changed"]
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self._runs),
+                "max_runs": self.max_runs,
+                "evicted_expired": self._evictions["expired"],
+                "evicted_capacity": self._evictions["capacity"],
+            }
+
+    def _touch(self, run_id: str) -> dict[str, Any] | None:
+        run = self._runs.get(run_id)
+        if run is not None:
+            run["last_seen"] = self._clock()
+            self._runs.move_to_end(run_id)
+        return run
+
+    def _evict(self, now: float) -> None:
+        while self._runs:
+            run_id, run = next(iter(self._runs.items()))
+            if now - run["last_seen"] <= self.ttl:
+                return
+            del self._runs[run_id]
+            run["changed"].set()
+            self._evictions["expired"] += 1
+
+
+class TimerScheduler:
+    """Runs delayed callbacks on the event loop with a global concurrency cap.
+
+    Each job is a ``loop.call_later`` handle: one heap entry and no thread
+    for the whole delay. At most ``max_active`` timers are armed at once.
+    Later jobs wait in a FIFO and their delay starts only when a slot frees
+    up, so a burst of runs cannot grow the timer heap without limit.
+    """
+
+    def __init__(self, max_active: int = 10000) -> None:
+        self.max_active = max_active
+        self._active = 0
+        self._waiting: deque[tuple[float, Callable[..., Any], tuple[Any, ...]]] = deque()
+        self._stats = {"scheduled": 0, "completed": 0, "queued": 0}
+
+    def schedule(self, delay: float, callback: Callable[..., Any], *args: Any) -> None:
+        self._stats["scheduled"] += 1
+        if self._active >= self.max_active:
+            self._stats["queued"] += 1
+            self._waiting.append((delay, callback, args))
+            return
+        self._arm(delay, callback, args)
+
+    def stats(self) -> dict[str, int]:
+        return {**self._stats, "active": self._active, "waiting": len(self._waiting)}
+
+    def _arm(self, delay: float, callback: Callable[..., Any], args: tuple[Any, ...]) -> None:
+        self._active += 1
+        asyncio.get_running_loop().call_later(delay, self._fire, callback, args)
+
+    def _fire(self, callback: Callable[..., Any], args: tuple[Any, ...]) -> None:
+        self._active -= 1
+        self._stats["completed"] += 1
+        try:
+            callback(*args)
+        finally:
+            if self._waiting:
+                self._arm(*self._waiting.popleft())
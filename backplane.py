@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import time
+from collections.abc import Callable
+from queue import Full, Queue
+from threading import Event, Lock, Thread
+from typing import Protocol
+
+Deliver = Callable[[str, str, int], None]
+logger = logging.getLogger(__name__)
+
+
+class Backplane(Protocol):
+    def start(self, deliver: Deliver) -> None: ...
+
+    def publish(self, channel: str, data: str) -> None: ...
+
+    def stats(self) -> dict[str, int | str | bool]: ...
+
+    def close(self) -> None: ...
+
+
+class _EventIds:
+    """Increasing event ids seeded from the wall clock in microseconds.
+
+    A broker that takes over keeps counting above the ids its predecessor
+    handed out, unless that one issued more than one id per microsecond.
+    """
+
+    def __init__(self, clock: Callable[[], int] = time.time_ns) -> None:
+        self._clock = clock
+        self._last = 0
+        self._lock = Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            self._last = max(self._last + 1, self._clock() // 1000)
+            return self._last
+
+
+class InMemoryBackplane:
+    """Single-process backplane: ``publish`` calls ``deliver`` right away."""
+
+    def __init__(self) -> None:
+        self._deliver: Deliver | None = None
+        self._ids = _EventIds()
+        self._stats = {"published": 0, "delivered": 0}
+
+    def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    def publish(self, channel: str, data: str) -> None:
+        self._stats["published"] += 1
+        if self._deliver is not None:
+            self._stats["delivered"] += 1
+            self._deliver(channel, data, self._ids.next_id())
+
+    def stats(self) -> dict[str, int | str | bool]:
+        return {**self._stats, "kind": "memory"}
+
+    def close(self) -> None:
+        self._deliver = None
+
+
+class UnixSocketBackplane:
+    """Fans events out to every worker process through a Unix socket broker.
+
+    On ``start`` each worker tries to take an exclusive ``flock`` on
+    ``path + ".lock"``. The holder is the broker: it binds ``path``, accepts
+    a connection per worker and relays every line it reads to all of them,
+    the sender included. Every worker, the broker too, connects as a client
+    and hands each line it reads to ``deliver`` on a reader thread. An event
+    is therefore written once and delivered once per worker, in broker order.
+
+    The broker stamps each event with an id from one increasing sequence, so
+    every worker delivers the same event under the same id. Ids are assigned
+    and queued under one lock, so they arrive in id order everywhere.
+
+    Every socket has a single writer thread fed by a bounded queue of
+    ``queue_size`` lines: ``publish`` only enqueues and never blocks the
+    caller, and the broker queues relayed lines per worker. A full queue
+    drops the line and counts it. Lines that are not a JSON array of the
+    expected strings (and id), and events ``deliver`` raises on, are skipped
+    and counted as ``malformed``; the reader keeps going.
+
+    The kernel releases the lock when the broker exits, so a crashed broker
+    cannot block the election and the next holder removes its socket file.
+    The other workers reconnect and race for the lock. Events published
+    during that gap are lost.
+    """
+
+    def __init__(self, path: str, retry_interval: float = 0.5, queue_size: int = 1024) -> None:
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.retry_interval = retry_interval
+        self.queue_size = queue_size
+        self.is_broker = False
+        self._deliver: Deliver | None = None
+        self._lock_fd: int | None = None
+        self._server: socket.socket | None = None
+        self._conn: socket.socket | None = None
+        self._outbox: Queue[bytes | None] = Queue(maxsize=queue_size)
+        self._clients: dict[socket.socket, Queue[bytes | None]] = {}
+        self._clients_lock = Lock()
+        self._relay_lock = Lock()
+        self._ids = _EventIds()
+        self._closed = Event()
+        self._stats = {
+            "published": 0,
+            "delivered": 0,
+            "relayed": 0,
+            "reconnects": 0,
+            "dropped": 0,
+            "malformed": 0,
+        }
+
+    def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        try:
+            self._connect()
+        except OSError:
+            # Another worker holds the lock but is not listening yet; the reader retries.
+            if self.is_broker:
+                raise
+        Thread(target=self._read, name="backplane-reader", daemon=True).start()
+        Thread(target=self._write, name="backplane-writer", daemon=True).start()
+
+    def publish(self, channel: str, data: str) -> None:
+        line = (json.dumps([channel, data]) + "\n").encode("utf-8")
+        try:
+            self._outbox.put_nowait(line)
+        except Full:
+            self._stats["dropped"] += 1
+
+    def stats(self) -> dict[str, int | str | bool]:
+        with self._clients_lock:
+            workers = len(self._clients)
+        return {**self._stats, "kind": "unix", "broker": self.is_broker, "workers": workers}
+
+    def close(self) -> None:
+        self._closed.set()
+        _put(self._outbox, None)
+        with self._clients_lock:
+            clients = list(self._clients)
+        for sock in [self._conn, self._server, *clients]:
+            if sock is not None:
+                _shutdown(sock)
+        if self.is_broker:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        # Unlink before releasing the lock, or the next broker's socket could be removed.
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _connect(self) -> None:
+        self._elect()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.path)
+        except OSError:
+            conn.close()
+            raise
+        self._conn = conn
+
+    def _elect(self) -> None:
+        import fcntl
+
+        if self.is_broker:
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        # Only the lock holder binds, so a socket file left here is stale.
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen()
+        self._server = server
+        self.is_broker = True
+        Thread(target=self._accept, name="backplane-broker", daemon=True).start()
+
+    def _accept(self) -> None:
+        assert self._server is not None
+        while not self._closed.is_set():
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            outbox: Queue[bytes | None] = Queue(maxsize=self.queue_size)
+            with self._clients_lock:
+                self._clients[client] = outbox
+            Thread(target=self._relay, args=(client,), name="backplane-relay", daemon=True).start()
+            Thread(
+                target=self._send_to, args=(client, outbox), name="backplane-send", daemon=True
+            ).start()
+
+    def _relay(self, client: socket.socket) -> None:
+        try:
+            with client.makefile("rb") as lines:
+                for line in lines:
+                    message = _decode(line, str, str)
+                    if message is None:
+                        self._stats["malformed"] += 1
+                        continue
+                    channel, data = message
+                    with self._relay_lock:
+                        event = json.dumps([self._ids.next_id(), channel, data]) + "\n"
+                        with self._clients_lock:
+                            outboxes = list(self._clients.values())
+                        for outbox in outboxes:
+                            if not _put(outbox, event.encode("utf-8")):
+                                self._stats["dropped"] += 1
+                    self._stats["relayed"] += 1
+        except OSError:
+            pass
+        self._drop_client(client)
+
+    def _send_to(self, client: socket.socket, outbox: Queue[bytes | None]) -> None:
+        while (line := outbox.get()) is not None:
+            try:
+                client.sendall(line)
+            except OSError:
+                self._drop_client(client)
+                return
+
+    def _drop_client(self, client: socket.socket) -> None:
+        with self._clients_lock:
+            outbox = self._clients.pop(client, None)
+        if outbox is not None:
+            _put(outbox, None)
+        _shutdown(client)
+
+    def _write(self) -> None:
+        while (line := self._outbox.get()) is not None:
+            conn = self._conn
+            if conn is None:
+                self._stats["dropped"] += 1
+                continue
+            try:
+                conn.sendall(line)
+            except OSError:
+                # The reader notices the broken connection and reconnects.
+                self._stats["dropped"] += 1
+                continue
+            self._stats["published"] += 1
+
+    def _deliver_line(self, event_id: int, channel: str, data: str) -> None:
+        if self._deliver is None:
+            return
+        try:
+            self._deliver(channel, data, event_id)
+        except Exception:
+            # A bad event must not take the reader thread down with it.
+            logger.exception("Backplane event %s on %r could not be delivered", event_id, channel)
+            self._stats["malformed"] += 1
+            return
+        self._stats["delivered"] += 1
+
+    def _read(self) -> None:
+        while not self._closed.is_set():
+            conn = self._conn
+            if conn is not None:
+                try:
+                    with conn.makefile("rb") as lines:
+                        for line in lines:
+                            message = _decode(line, int, str, str)
+                            if message is None:
+                                self._stats["malformed"] += 1
+                                continue
+                            self._deliver_line(*message)
+                except OSError:
+                    pass
+                _shutdown(conn)
+            while not self._closed.is_set():
+                time.sleep(self.retry_interval)
+                try:
+                    self._connect()
+                except OSError:
+                    continue
+                self._stats["reconnects"] += 1
+                break
+
+
+def _decode(line: bytes, *types: type) -> list | None:
+    """Parse a JSON array line whose items have exactly ``types``, else None."""
+    try:
+        message = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(message, list) or len(message) != len(types):
+        return None
+    for item, expected in zip(message, types):
+        if type(item) is not expected:
+            return None
+    return message
+
+
+def _put(queue: Queue[bytes | None], item: bytes | None) -> bool:
+    try:
+        queue.put_nowait(item)
+    except Full:
+        return False
+    return True
+
+
+def _shutdown(sock: socket.socket) -> None:
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
@@ -1,21 +1,66 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import functools
+import gzip
+import hashlib
 import inspect
 import json
+import logging
+import os
 import random
-import time
-import uuid
 from datetime import datetime
+from html import escape
 from threading import Lock
-from time import sleep
-from typing import Any
+from typing import Any, Awaitable, Callable, Literal
+from urllib.parse import urlencode
 
-from fastapi import FastAPI, Form, HTTPException, Request, WebSocket
+from fastapi import FastAPI, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-
+from starlette.background import BackgroundTask
+
+from async_jobs import JobRegistry, TimerScheduler
+from backplane import Backplane, InMemoryBackplane, UnixSocketBackplane
+from search_index import SearchIndex
+from sse_hub import BroadcastHub, encode_event
+from todo_store import SQLiteTodoBackend, TodoStore
+from ws_rooms import Connection, RoomHub, split_oob
+
+TODO_PAGE_SIZE = 50
+BACKPLANE_PATH = os.environ.get("HTMX_DEMO_BACKPLANE", "")
+LATENCY_SCALE = float(os.environ.get("HTMX_DEMO_LATENCY_SCALE", "1"))
+ASYNC_WORKERS = 5
+ASYNC_MAX_RUNS = 1000
+ASYNC_RUN_TTL = 600.0
+ASYNC_MAX_ACTIVE_WORKERS = 10000
+ASYNC_STREAM_KEEPALIVE = 15.0
+ASYNC_LONG_POLL_MAX = 30.0
+HTMX_STOP_POLLING = 286
+SSE_TICK_INTERVAL = 2.0
+SSE_BUFFER_SIZE = 16
+SSE_HISTORY = 64
+SSE_TOPICS = ("ticks", "todos", "jobs")
+SSE_HEARTBEAT_INTERVAL = 15.0
+SSE_DISCONNECT_POLL = 1.0
+SSE_MAX_STREAMS = int(os.environ.get("HTMX_DEMO_SSE_MAX_STREAMS", "1000"))
+SSE_RETRY_AFTER = 5
+WS_SEND_QUEUE = 64
+WS_SEND_POLICY: Literal["drop", "disconnect"] = "drop"
+WS_SEND_TIMEOUT = 10.0
+WS_MESSAGE_RATE = 10.0
+WS_MESSAGE_BURST = 20
+WS_COALESCE_WINDOW = float(os.environ.get("HTMX_DEMO_WS_COALESCE", "0"))
+WS_DEFLATE_METRICS = os.environ.get("HTMX_DEMO_WS_DEFLATE_METRICS", "") == "1"
+WS_DEFLATE_SAMPLE = int(os.environ.get("HTMX_DEMO_WS_DEFLATE_SAMPLE", "16"))
+WS_CLOSE_CODES = {"slow_consumer": 1013, "send_timeout": 1001, "error": 1011}
+WS_ROOM_NAME_MAX = 64
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_DISTANCE = 3
+
+logger = logging.getLogger(__name__)
 app = FastAPI(title="HTMX Teaching App", version="1.0.0")
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -35,13 +80,19 @@ animate_value = 0
 morph_lock = Lock()
 morph_flip = False
 
-todos_lock = Lock()
-todos = [
-    {"id": 1, "text": "Skim the HTMX docs", "done": False},
-    {"id": 2, "text": "Wire a form with hx-post", "done": False},
-    {"id": 3, "text": "Try hx-swap-oob", "done": True},
-]
-next_todo_id = 4
+TODO_DB_PATH = os.environ.get("HTMX_DEMO_TODO_DB", "")
+todos = TodoStore(
+    [
+        {"id": 1, "text": "Skim the HTMX docs", "done": False},
+        {"id": 2, "text": "Wire a form with hx-post", "done": False},
+        {"id": 3, "text": "Try hx-swap-oob", "done": True},
+    ],
+    backend=SQLiteTodoBackend(TODO_DB_PATH) if TODO_DB_PATH else None,
+)
+
+home_cache_lock = Lock()
+home_version = 0
+_home_cache: dict[str, Any] = {"version": (-1, -1), "identity": b"", "gzip": b""}
 
 catalog = [
     "Alpine JS",
@@ -64,6 +115,7 @@ catalog = [
     "RESTful Actions",
     "Swap Strategies",
 ]
+catalog_index = SearchIndex(catalog)
 
 jinja_topics = [
     {"name": "Context variables", "detail": "Render server data into HTML."},
@@ -76,11 +128,17 @@ jinja_alerts = [
     {"kind": "info", "message": "Macros can be shared across partials."},
 ]
 
-async_runs_lock = Lock()
-async_runs: dict[str, dict[str, Any]] = {}
+cancellation_stats: dict[str, float] = {
+    "started": 0,
+    "completed": 0,
+    "cancelled": 0,
+    "cancelled_seconds": 0.0,
+}
 
 GUIDE_DEMOS: dict[str, dict[str, Any]] = {}
 _GUIDES_CACHE: dict[str, dict[str, str]] | None = None
+_GUIDES_PAYLOAD = b""
+_GUIDES_DIGEST = ""
 
 
 def _server_stub(func: Any) -> str:
@@ -117,44 +175,181 @@ def _build_guides() -> dict[str, dict[str, str]]:
     return guides
 
 
+def _encode_guides() -> tuple[bytes, str]:
+    payload = json.dumps(_build_guides(), separators=(",", ":")).encode("utf-8")
+    return payload, hashlib.sha256(payload).hexdigest()[:16]
+
+
+def _guides_url() -> str:
+    return f"/guides/{_GUIDES_DIGEST}.json"
+
+
+def _bump_home_version() -> None:
+    global home_version
+    with home_cache_lock:
+        home_version += 1
+
+
+def _cached_home_page() -> dict[str, Any]:
+    global _home_cache
+    revision = todos.refresh()
+    with home_cache_lock:
+        version = (home_version, revision)
+        if _home_cache["version"] == version:
+            return _home_cache
+    until = todos.last_id()
+    page, todo_cursor = todos.page(until=until, limit=TODO_PAGE_SIZE)
+    home_matches, home_cursor = catalog_index.ranked("", limit=SEARCH_PAGE_SIZE)
+    html = templates.get_template("index.html").render(
+        todos=page,
+        todo_status="all",
+        todo_until=until,
+        todo_cursor=todo_cursor,
+        todo_counts=todos.counts(),
+        catalog=catalog,
+        q="",
+        matches=home_matches,
+        next_cursor=home_cursor,
+        limit=SEARCH_PAGE_SIZE,
+        guides_url=_guides_url(),
+    )
+    body = html.encode("utf-8")
+    entry = {"version": version, "identity": body, "gzip": gzip.compress(body, compresslevel=6)}
+    with home_cache_lock:
+        if _home_cache["version"] < version:
+            _home_cache = entry
+    return entry
+
+
+async def _simulate_latency(seconds: float) -> None:
+    await asyncio.sleep(seconds * LATENCY_SCALE)
+
+
+async def _wait_for_disconnect(request: Request, interval: float = 0.1) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+def cancel_on_disconnect(
+    handler: Callable[..., Awaitable[Response]],
+) -> Callable[..., Awaitable[Response]]:
+    # Runs the handler as a task next to a disconnect watcher. When the client
+    # goes away first (hx-sync replace, hx-request timeout, closed tab) the
+    # handler task is cancelled at its next await, so it never reaches the
+    # template render. Only use on handlers that do not read the request body:
+    # is_disconnected() consumes receive() messages.
+    @functools.wraps(handler)
+    async def wrapper(**kwargs: Any) -> Response:
+        request: Request = kwargs["request"]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        cancellation_stats["started"] += 1
+        task = asyncio.ensure_future(handler(**kwargs))
+        watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+        try:
+            await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Also reached when the wrapper itself is cancelled: take the handler down too.
+            watcher.cancel()
+            if not task.done():
+                task.cancel()
+        if task.done():
+            cancellation_stats["completed"] += 1
+            return task.result()
+        cancellation_stats["cancelled"] += 1
+        cancellation_stats["cancelled_seconds"] += loop.time() - started
+        return Response(status_code=499)
+
+    return wrapper
+
+
+def _render_tile(payload: dict[str, Any]) -> bytes:
+    return templates.get_template("partials/async_tile.html").render(tile=payload).encode("utf-8")
+
+
+async_runs = JobRegistry(_render_tile, max_runs=ASYNC_MAX_RUNS, ttl=ASYNC_RUN_TTL)
+async_workers = TimerScheduler(max_active=ASYNC_MAX_ACTIVE_WORKERS)
+_ASYNC_OFFSET_OOB = [
+    templates.get_template("partials/async_offset.html").render(next_offset=n).encode("utf-8")
+    for n in range(ASYNC_WORKERS + 1)
+]
+_ASYNC_DONE_OOB = templates.get_template("partials/async_done.html").render().encode("utf-8")
+
+
+def _async_offset_oob(offset: int) -> bytes:
+    if 0 <= offset < len(_ASYNC_OFFSET_OOB):
+        return _ASYNC_OFFSET_OOB[offset]
+    return templates.get_template("partials/async_offset.html").render(next_offset=offset).encode("utf-8")
+
+
 def _start_async_run() -> str:
-    run_id = str(uuid.uuid4())
-    with async_runs_lock:
-        async_runs[run_id] = {"created": datetime.now(), "results": [], "total": 5}
-    for idx in range(1, 6):
-        asyncio.create_task(asyncio.to_thread(_async_worker, run_id, idx))
+    run_id = async_runs.create(total=ASYNC_WORKERS)
+    for idx in range(1, ASYNC_WORKERS + 1):
+        duration = random.randint(10, 90)
+        async_workers.schedule(duration * LATENCY_SCALE, _async_worker, run_id, idx, duration)
     return run_id
 
 
-def _async_worker(run_id: str, worker_id: int) -> None:
-    duration = random.randint(10, 90)
-    time.sleep(duration)
+def _async_worker(run_id: str, worker_id: int, duration: int) -> None:
     payload = {
         "worker_id": worker_id,
         "duration": duration,
         "completed_at": datetime.now().strftime("%H:%M:%S"),
         "summary": f"Worker {worker_id} finished after {duration}s.",
     }
-    with async_runs_lock:
-        run = async_runs.get(run_id)
-        if not run:
-            return
-        run["results"].append(payload)
+    if async_runs.append_result(run_id, payload):
+        backplane.publish(
+            "sse:jobs",
+            f"<div class='result'>Run {run_id[:8]}: worker {worker_id} finished "
+            f"after {duration}s.</div>",
+        )
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    # An explicit gzip (or x-gzip) entry wins over "*"; q=0 means "not acceptable".
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, *params = (piece.strip() for piece in part.split(";"))
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.lower()] = weight
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in weights:
+            return weights[coding] > 0
+    return False
 
 
 @app.get("/")
 def home(request: Request) -> HTMLResponse:
-    now = datetime.now()
-    return render(
-        request,
-        "index.html",
-        todos=todos,
-        catalog=catalog,
-        q="",
-        matches=catalog[:5],
-        now=now,
-        guides=_build_guides(),
-    )
+    page = _cached_home_page()
+    headers = {"Vary": "Accept-Encoding"}
+    if _accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        return HTMLResponse(content=page["gzip"], headers=headers)
+    return HTMLResponse(content=page["identity"], headers=headers)
+
+
+@app.get("/server-time")
+def server_time(request: Request) -> HTMLResponse:
+    return render(request, "partials/server_time.html", now=datetime.now())
+
+
+@app.get("/guides/{digest}.json")
+def guides_payload(request: Request, digest: str) -> Response:
+    if digest != _GUIDES_DIGEST:
+        raise HTTPException(status_code=404, detail="Guide payload not found")
+    etag = f'"{_GUIDES_DIGEST}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    candidates = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers=headers)
+    return Response(content=_GUIDES_PAYLOAD, media_type="application/json", headers=headers)
 
 
 @app.get("/page/about")
@@ -220,13 +415,60 @@ def counter(request: Request) -> HTMLResponse:
 
 
 @app.get("/search")
-def search(request: Request, q: str | None = None) -> HTMLResponse:
-    term = (q or "").strip().lower()
-    if not term:
-        matches = catalog[:5]
-    else:
-        matches = [item for item in catalog if term in item.lower()]
-    return render(request, "partials/search_results.html", q=q or "", matches=matches)
+def search(
+    request: Request,
+    q: str | None = None,
+    limit: int = SEARCH_PAGE_SIZE,
+    cursor: str | None = None,
+    mode: Literal["exact", "fuzzy"] = "exact",
+    distance: int = 1,
+) -> HTMLResponse:
+    limit = max(1, min(limit, 100))
+    if mode == "fuzzy" and q and not cursor:
+        fuzzy = catalog_index.fuzzy(
+            q, max_distance=max(0, min(distance, SEARCH_MAX_DISTANCE)), limit=limit
+        )
+        if fuzzy is not None:
+            # Fuzzy matching compares whole words, so a word still being typed
+            # ("hyper") only matches exactly. Exact and prefix hits rank first.
+            matches, _ = catalog_index.ranked(q, limit=limit)
+            matches += [match for match in fuzzy if match not in matches][: limit - len(matches)]
+            return render(
+                request,
+                "partials/search_results.html",
+                q=q,
+                matches=matches,
+                next_cursor=None,
+                limit=limit,
+            )
+    try:
+        matches, next_cursor = catalog_index.ranked(q or "", limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    template = "partials/search_page.html" if cursor else "partials/search_results.html"
+    return render(
+        request,
+        template,
+        q=q or "",
+        matches=matches,
+        next_cursor=next_cursor,
+        limit=limit,
+    )
+
+
+@app.get("/stats")
+def stats() -> dict[str, Any]:
+    return {
+        "search_cache": catalog_index.cache_stats(),
+        "search_fuzzy_fallbacks": catalog_index.fuzzy_fallbacks,
+        "cancellation": cancellation_stats,
+        "async_runs": async_runs.stats(),
+        "async_workers": async_workers.stats(),
+        "sse": sse_hub.stats(),
+        "sse_streams": {**sse_streams, "max": SSE_MAX_STREAMS},
+        "ws_rooms": ws_rooms.stats(),
+        "backplane": backplane.stats(),
+    }
 
 
 @app.post("/form/validate")
@@ -273,8 +515,9 @@ def select_demo(request: Request) -> HTMLResponse:
 
 
 @app.get("/sync-demo")
-def sync_demo(request: Request, item: str = "Alpha") -> HTMLResponse:
-    sleep(1)
+@cancel_on_disconnect
+async def sync_demo(request: Request, item: str = "Alpha") -> HTMLResponse:
+    await _simulate_latency(1)
     return render(request, "partials/sync_demo.html", item=item, now=datetime.now())
 
 
@@ -302,8 +545,9 @@ def redirect_demo() -> Response:
 
 
 @app.get("/disabled-demo")
-def disabled_demo(request: Request) -> HTMLResponse:
-    sleep(1)
+@cancel_on_disconnect
+async def disabled_demo(request: Request) -> HTMLResponse:
+    await _simulate_latency(1)
     return render(request, "partials/disabled_demo.html", now=datetime.now())
 
 
@@ -430,28 +674,53 @@ def morph_demo(request: Request) -> HTMLResponse:
 
 
 @app.get("/async-dashboard/poll")
-def async_dashboard_poll(request: Request, run_id: str, offset: int = 0) -> HTMLResponse:
-    with async_runs_lock:
-        run = async_runs.get(run_id)
-        if not run:
-            return render(
-                request,
-                "partials/async_tiles.html",
-                tiles=[],
-                done=True,
-                next_offset=offset,
-            )
-        results = run["results"]
-        total = run["total"]
-    new_tiles = results[offset:]
-    done = offset + len(new_tiles) >= total
-    return render(
-        request,
-        "partials/async_tiles.html",
-        tiles=new_tiles,
-        done=done,
-        next_offset=offset + len(new_tiles),
-    )
+async def async_dashboard_poll(
+    request: Request, run_id: str, offset: int = 0, wait: float = 0
+) -> HTMLResponse:
+    offset = max(0, offset)
+    wait = max(0.0, min(wait, ASYNC_LONG_POLL_MAX))
+    if wait:
+        await async_runs.wait_for_change(run_id, offset, wait)
+    run = async_runs.get(run_id)
+    if not run:
+        return HTMLResponse(
+            content=_async_offset_oob(offset) + _ASYNC_DONE_OOB,
+            status_code=HTMX_STOP_POLLING,
+        )
+    new_tiles = run["tiles"][offset:]
+    next_offset = offset + len(new_tiles)
+    if next_offset >= run["total"]:
+        return HTMLResponse(
+            content=b"".join(new_tiles) + _async_offset_oob(next_offset) + _ASYNC_DONE_OOB,
+            status_code=HTMX_STOP_POLLING,
+        )
+    return HTMLResponse(content=b"".join(new_tiles) + _async_offset_oob(next_offset))
+
+
+@app.get("/async-dashboard/stream")
+async def async_dashboard_stream(request: Request, run_id: str) -> StreamingResponse:
+    last_event_id = request.headers.get("last-event-id", "")
+    offset = int(last_event_id) if last_event_id.isdigit() else 0
+
+    async def event_stream() -> Any:
+        nonlocal offset
+        while True:
+            run = async_runs.get(run_id)
+            if run is None:
+                yield encode_event("done", '<div class="muted">This run has expired.</div>')
+                return
+            for tile in run["tiles"][offset:]:
+                offset += 1
+                yield encode_event("tile", tile.decode("utf-8"), event_id=offset)
+            if offset >= run["total"]:
+                yield encode_event("done", '<div class="muted">All workers finished.</div>')
+                return
+            if not await async_runs.wait_for_change(run_id, offset, ASYNC_STREAM_KEEPALIVE):
+                yield b": keepalive\n\n"
+
+    response = StreamingResponse(event_stream(), media_type="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @app.get("/animate")
@@ -490,77 +759,359 @@ def event_header(request: Request) -> HTMLResponse:
 
 
 @app.get("/slow")
-def slow(request: Request) -> HTMLResponse:
-    sleep(2)
+@cancel_on_disconnect
+async def slow(request: Request) -> HTMLResponse:
+    await _simulate_latency(2)
     return render(request, "partials/slow.html", now=datetime.now())
 
 
+sse_hub = BroadcastHub(
+    SSE_TOPICS, buffer_size=SSE_BUFFER_SIZE, history=SSE_HISTORY, policy="drop"
+)
+sse_streams = {"open": 0, "peak": 0, "rejected": 0, "reaped": 0}
+_tick_producer: asyncio.Task | None = None
+
+
+async def _produce_ticks() -> None:
+    while sse_hub.has_subscribers("ticks"):
+        now = datetime.now()
+        sse_hub.publish("ticks", f"<div class='result'>SSE tick {now.strftime('%H:%M:%S')}</div>")
+        await asyncio.sleep(SSE_TICK_INTERVAL)
+
+
+def _ensure_tick_producer() -> None:
+    global _tick_producer
+    if _tick_producer is None or _tick_producer.done():
+        _tick_producer = asyncio.create_task(_produce_ticks())
+
+
+def _publish_todo_change(action: str, todo: dict[str, Any]) -> None:
+    text = f": {escape(todo['text'])}" if "text" in todo else ""
+    backplane.publish(
+        "sse:todos", f"<div class='result'>Todo #{todo['id']} {action}{text}</div>"
+    )
+
+
 @app.get("/sse")
-async def sse() -> StreamingResponse:
-    async def event_stream() -> Any:
-        while True:
-            now = datetime.now()
-            payload = (
-                "event: message\n"
-                f"data: <div class='result'>SSE tick {now.strftime('%H:%M:%S')}</div>\n\n"
-            )
-            yield payload
-            await asyncio.sleep(2)
+async def sse(request: Request, topics: str = "ticks") -> StreamingResponse:
+    selected = {topic.strip() for topic in topics.split(",")} & sse_hub.topics
+    if not selected:
+        raise HTTPException(status_code=400, detail="Unknown SSE topics")
+    if sse_streams["open"] >= SSE_MAX_STREAMS:
+        sse_streams["rejected"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Too many open event streams",
+            headers={"Retry-After": str(SSE_RETRY_AFTER)},
+        )
+    # Reserve the slot now so a burst of requests cannot all pass the check.
+    # The stream releases it when it ends, the background task if it never starts.
+    sse_streams["open"] += 1
+    sse_streams["peak"] = max(sse_streams["peak"], sse_streams["open"])
+    reserved = True
 
-    response = StreamingResponse(event_stream(), media_type="text/event-stream")
+    def release() -> None:
+        nonlocal reserved
+        if reserved:
+            reserved = False
+            sse_streams["open"] -= 1
+
+    last_event_id = request.headers.get("last-event-id", "")
+
+    async def event_stream() -> Any:
+        subscription = sse_hub.subscribe(
+            selected, int(last_event_id) if last_event_id.isdigit() else None
+        )
+        if "ticks" in selected:
+            _ensure_tick_producer()
+        # Heartbeats make writes to a dead socket fail within one interval;
+        # the watcher ends the stream as soon as the server sees the disconnect.
+        watcher = asyncio.ensure_future(_wait_for_disconnect(request, SSE_DISCONNECT_POLL))
+
+        def reap(task: asyncio.Future) -> None:
+            if not task.cancelled() and not subscription.closed:
+                sse_streams["reaped"] += 1
+                sse_hub.unsubscribe(subscription)
+
+        watcher.add_done_callback(reap)
+        try:
+            async for frame in subscription.frames(heartbeat=SSE_HEARTBEAT_INTERVAL):
+                yield frame
+        finally:
+            watcher.cancel()
+            release()
+            sse_hub.unsubscribe(subscription)
+
+    response = StreamingResponse(
+        event_stream(), media_type="text/event-stream", background=BackgroundTask(release)
+    )
     response.headers["Cache-Control"] = "no-cache"
     return response
 
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket) -> None:
-    await websocket.accept()
+ws_rooms = RoomHub(
+    queue_size=WS_SEND_QUEUE,
+    policy=WS_SEND_POLICY,
+    rate=WS_MESSAGE_RATE,
+    burst=WS_MESSAGE_BURST,
+    coalesce_window=WS_COALESCE_WINDOW,
+    measure_deflate=WS_DEFLATE_METRICS,
+    deflate_sample=WS_DEFLATE_SAMPLE,
+)
+
+
+def _deliver_event(channel: str, data: str, event_id: int) -> None:
+    kind, _, name = channel.partition(":")
+    if kind == "sse" and name in sse_hub.topics:
+        sse_hub.publish_threadsafe(name, data, event_id)
+    elif kind == "ws":
+        ws_rooms.broadcast_threadsafe(name, data)
+
+
+backplane: Backplane = (
+    UnixSocketBackplane(BACKPLANE_PATH) if BACKPLANE_PATH else InMemoryBackplane()
+)
+backplane.start(_deliver_event)
+
+
+# HTTP routes a ws-send form may call by naming them in a "route" field,
+# mapped to the OOB swap style used to place the response at HX-Target.
+WS_ROUTES = {
+    "GET /counter": "innerHTML",
+    "GET /hello": "innerHTML",
+    "GET /search": "innerHTML",
+    "POST /todos": "beforeend",
+}
+
+
+def _ws_envelope(raw: str) -> dict[str, Any]:
+    try:
+        payload = json.loads(raw)
+    except ValueError:
+        return {"message": raw}
+    return payload if isinstance(payload, dict) else {"message": raw}
+
+
+def _ws_error_frame(message: str) -> str:
+    return (
+        '<div id="ws-messages" hx-swap-oob="beforeend">'
+        f'<div class="alert">{escape(message)}</div>'
+        "</div>"
+    )
+
+
+async def _ws_subrequest(
+    scope: dict[str, Any],
+    method: str,
+    path: str,
+    fields: dict[str, str],
+    hx_headers: dict[str, str | None],
+) -> tuple[int, bytes]:
+    encoded = urlencode(fields).encode("utf-8")
+    headers = [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in hx_headers.items()
+        if value is not None
+    ]
+    if method != "GET":
+        headers.append((b"content-type", b"application/x-www-form-urlencoded"))
+    sub_scope = {
+        "type": "http",
+        "asgi": scope.get("asgi", {"version": "3.0"}),
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "https" if scope.get("scheme") == "wss" else "http",
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "root_path": scope.get("root_path", ""),
+        "query_string": encoded if method == "GET" else b"",
+        "headers": headers,
+        "client": scope.get("client"),
+        "server": scope.get("server"),
+    }
+    pending = [{"type": "http.request", "body": b"" if method == "GET" else encoded}]
+    status = 500
+    body: list[bytes] = []
+
+    async def receive() -> dict[str, Any]:
+        return pending.pop() if pending else {"type": "http.disconnect"}
+
+    async def send(message: dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(sub_scope, receive, send)
+    return status, b"".join(body)
+
+
+def _is_hx_header(name: Any, value: Any) -> bool:
+    if not isinstance(name, str) or not name.lower().startswith("hx-"):
+        return False
+    if value is not None and not isinstance(value, str):
+        return False
+    try:
+        (name + (value or "")).encode("latin-1")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+async def _dispatch_ws_request(scope: dict[str, Any], envelope: dict[str, Any]) -> str:
+    route = str(envelope.get("route", ""))
+    swap = WS_ROUTES.get(route)
+    hx_headers = envelope.get("HEADERS") or {}
+    if not isinstance(hx_headers, dict):
+        return _ws_error_frame("HEADERS must be an object")
+    if not all(_is_hx_header(name, value) for name, value in hx_headers.items()):
+        return _ws_error_frame("HEADERS may only carry HX-* string headers")
+    target = hx_headers.get("HX-Target")
+    if swap is None:
+        return _ws_error_frame(f"Unsupported route: {route}")
+    if not target:
+        return _ws_error_frame(f"{route} needs an hx-target")
+    method, path = route.split(" ", 1)
+    fields = {
+        name: str(value) for name, value in envelope.items() if name not in ("HEADERS", "route")
+    }
+    status, body = await _ws_subrequest(scope, method, path, fields, hx_headers)
+    if status >= 400:
+        return _ws_error_frame(f"{route} failed with status {status}")
+    # Only top-level elements are swapped, so the response's own OOB swaps go beside the wrapper.
+    content, oob = split_oob(body.decode("utf-8"))
+    return f'<div id="{escape(target)}" hx-swap-oob="{swap}">{content}</div>{oob}'
+
+
+def _ws_message_frame(room: str, message: str) -> str:
+    now = datetime.now().strftime("%H:%M:%S")
+    return (
+        '<div id="ws-messages" hx-swap-oob="beforeend">'
+        f'<div class="result">WS {now} [{escape(room)}]: {escape(message)}</div>'
+        "</div>"
+    )
+
+
+async def _ws_receive(websocket: WebSocket, connection: Connection, room: str) -> None:
     try:
         while True:
-            message = await websocket.receive_text()
-            now = datetime.now().strftime("%H:%M:%S")
-            html = (
-                '<div id="ws-messages" hx-swap-oob="beforeend">'
-                f'<div class="result">WS {now}: {message}</div>'
-                "</div>"
-            )
-            await websocket.send_text(html)
+            raw = await websocket.receive_text()
+            if not connection.allow():
+                connection.send(_ws_error_frame("Rate limit exceeded, message dropped."))
+                continue
+            envelope = _ws_envelope(raw)
+            if "route" in envelope:
+                connection.send(await _dispatch_ws_request(websocket.scope, envelope))
+            else:
+                message = str(envelope.get("message", ""))
+                backplane.publish(f"ws:{room}", _ws_message_frame(room, message))
+    except WebSocketDisconnect:
+        connection.close("client_closed")
     except Exception:
-        await websocket.close()
+        logger.exception("WebSocket receive loop failed in room %s", room)
+        connection.close("error")
+
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, room: str = "lobby") -> None:
+    await websocket.accept()
+    room = room[:WS_ROOM_NAME_MAX] or "lobby"
+    extensions = websocket.headers.get("sec-websocket-extensions", "")
+    connection = ws_rooms.connect(websocket.send_text, deflate="permessage-deflate" in extensions)
+    ws_rooms.join(connection, room)
+    tasks = [
+        asyncio.ensure_future(connection.pump(WS_SEND_TIMEOUT)),
+        asyncio.ensure_future(_ws_receive(websocket, connection, room)),
+        asyncio.ensure_future(connection.closed.wait()),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        ws_rooms.disconnect(connection)
+    code = WS_CLOSE_CODES.get(connection.close_reason or "")
+    if code is not None:
+        with contextlib.suppress(Exception):
+            await asyncio.wait_for(websocket.close(code), WS_SEND_TIMEOUT)
+
+
+def _render_todo_mutation(
+    request: Request, todo: dict[str, Any] | None = None, error: str = ""
+) -> HTMLResponse:
+    return render(
+        request,
+        "partials/todo_mutation.html",
+        todo=todo,
+        todo_counts=todos.counts(),
+        error=error,
+    )
+
+
+@app.get("/todos")
+def list_todos(
+    request: Request,
+    status: Literal["all", "active", "done"] = "all",
+    after: int = 0,
+    until: int | None = None,
+    limit: int = TODO_PAGE_SIZE,
+) -> HTMLResponse:
+    if until is None:
+        until = todos.last_id()
+    page, todo_cursor = todos.page(status, after=after, until=until, limit=max(1, min(limit, 200)))
+    # The first page renders the whole filtered view: page container, the
+    # revealed sentinel, and an empty tail that new rows are appended to.
+    return render(
+        request,
+        "partials/todo_page.html" if after else "partials/todo_view.html",
+        todos=page,
+        todo_status=status,
+        todo_until=until,
+        todo_cursor=todo_cursor,
+    )
 
 
 @app.post("/todos")
-def add_todo(request: Request, text: str = Form("")) -> HTMLResponse:
-    global next_todo_id
+def add_todo(
+    request: Request,
+    text: str = Form(""),
+    status: Literal["all", "active", "done"] = Form("all"),
+) -> HTMLResponse:
     clean_text = text.strip()
     if not clean_text:
-        return render(request, "partials/todos.html", todos=todos, error="Enter a task.")
-    with todos_lock:
-        todos.append({"id": next_todo_id, "text": clean_text, "done": False})
-        next_todo_id += 1
-    return render(request, "partials/todos.html", todos=todos, error="")
+        return _render_todo_mutation(request, error="Enter a task.")
+    todo = todos.add(clean_text)
+    _bump_home_version()
+    _publish_todo_change("added", todo)
+    # A new task is active, so the "done" view only gets the summary update.
+    return _render_todo_mutation(request, todo=None if status == "done" else todo)
 
 
 @app.put("/todos/{todo_id}")
-def toggle_todo(request: Request, todo_id: int) -> HTMLResponse:
-    with todos_lock:
-        for todo in todos:
-            if todo["id"] == todo_id:
-                todo["done"] = not todo["done"]
-                break
-        else:
-            raise HTTPException(status_code=404, detail="Todo not found")
-    return render(request, "partials/todos.html", todos=todos, error="")
+def toggle_todo(
+    request: Request,
+    todo_id: int,
+    status: Literal["all", "active", "done"] = Form("all"),
+) -> HTMLResponse:
+    todo = todos.toggle(todo_id)
+    if todo is None:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    _bump_home_version()
+    _publish_todo_change("completed" if todo["done"] else "reopened", todo)
+    # A row that no longer matches the filtered view is swapped out for nothing.
+    hidden = status == ("active" if todo["done"] else "done")
+    return _render_todo_mutation(request, todo=None if hidden else todo)
 
 
 @app.delete("/todos/{todo_id}")
 def delete_todo(request: Request, todo_id: int) -> HTMLResponse:
-    with todos_lock:
-        remaining = [todo for todo in todos if todo["id"] != todo_id]
-        if len(remaining) == len(todos):
-            raise HTTPException(status_code=404, detail="Todo not found")
-        todos[:] = remaining
-    return render(request, "partials/todos.html", todos=todos, error="")
+    todo = todos.delete(todo_id)
+    if todo is None:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    _bump_home_version()
+    _publish_todo_change("deleted", todo)
+    return _render_todo_mutation(request)
 
 
 @app.post("/request-info")
@@ -793,3 +1344,5 @@ GUIDE_DEMOS.update(
         },
     }
 )
+
+_GUIDES_PAYLOAD, _GUIDES_DIGEST = _encode_guides()
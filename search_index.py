@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import heapq
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from itertools import islice
+from threading import Lock
+
+
+def normalize(text: str) -> str:
+    return text.strip().lower()
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def match_rank(normalized: str, term: str) -> int:
+    if not term or normalized.startswith(term):
+        return 0
+    pos = normalized.find(term)
+    while pos > 0:
+        if not normalized[pos - 1].isalnum():
+            return 1
+        pos = normalized.find(term, pos + 1)
+    return 2
+
+
+def word_trigrams(word: str) -> set[str]:
+    """Trigrams of ``word`` padded with two spaces on each side (``len + 2`` of them)."""
+    return trigrams(f"  {word}  ")
+
+
+def edit_distance(a: str, b: str, limit: int | None = None) -> int:
+    """Levenshtein distance, or ``limit + 1`` as soon as it must exceed ``limit``.
+
+    With a ``limit`` only the diagonal band of width ``2 * limit + 1`` is
+    computed, and the scan stops once a whole row is past the limit.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is None:
+        limit = len(a)
+    if len(a) - len(b) > limit:
+        return limit + 1
+    over = limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [over] * len(b)
+        lowest = i
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != b[j - 1]))
+            current[j] = cost
+            lowest = min(lowest, cost)
+        if lowest > limit:
+            return over
+        previous = current
+    return min(previous[-1], over)
+
+
+def encode_cursor(key: tuple[int, int, int]) -> str:
+    return "-".join(str(part) for part in key)
+
+
+def decode_cursor(cursor: str) -> tuple[int, int, int]:
+    rank, length, entry_id = (int(part) for part in cursor.split("-"))
+    return rank, length, entry_id
+
+
+class SearchIndex:
+    """Substring search over catalog entries backed by a trigram inverted index.
+
+    Entries are lower-cased once when added. A query of three or more
+    characters intersects the posting lists of its trigrams, starting from the
+    smallest one, and only the surviving candidates are checked with ``in``.
+    Shorter queries have no trigrams and fall back to scanning the
+    pre-normalized entries. ``add`` and ``remove`` update the postings in
+    place, so the index never needs a full rebuild when the catalog changes.
+
+    Results are kept in a bounded LRU keyed by normalized term. Debounced
+    search-as-you-type sends mostly prefix extensions ("po", "pol", "poll").
+    On a miss, the result of the longest cached prefix is a superset of the
+    answer, so it is narrowed instead of going back to the index.
+
+    Typo-tolerant lookups use a second trigram index over the distinct words
+    of every entry (see ``fuzzy``).
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[str] = (),
+        cache_size: int = 256,
+        fuzzy_budget: float = 0.02,
+    ) -> None:
+        self.lock = Lock()
+        self.cache_size = cache_size
+        self.fuzzy_budget = fuzzy_budget
+        self.fuzzy_fallbacks = 0
+        self._words: dict[str, set[int]] = {}
+        self._word_postings: dict[str, set[str]] = {}
+        self._entries: dict[int, str] = {}
+        self._normalized: dict[int, str] = {}
+        self._postings: dict[str, set[int]] = {}
+        self._cache: OrderedDict[str, tuple[int, ...]] = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "narrowed": 0, "evictions": 0}
+        self._next_id = 0
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, entry: str) -> int:
+        with self.lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            normalized = normalize(entry)
+            self._entries[entry_id] = entry
+            self._normalized[entry_id] = normalized
+            for gram in trigrams(normalized):
+                self._postings.setdefault(gram, set()).add(entry_id)
+            for word in normalized.split():
+                if word not in self._words:
+                    self._words[word] = set()
+                    for gram in word_trigrams(word):
+                        self._word_postings.setdefault(gram, set()).add(word)
+                self._words[word].add(entry_id)
+            self._cache.clear()
+            return entry_id
+
+    def remove(self, entry_id: int) -> bool:
+        with self.lock:
+            normalized = self._normalized.pop(entry_id, None)
+            if normalized is None:
+                return False
+            del self._entries[entry_id]
+            self._cache.clear()
+            for gram in trigrams(normalized):
+                posting = self._postings.get(gram)
+                if posting is None:
+                    continue
+                posting.discard(entry_id)
+                if not posting:
+                    del self._postings[gram]
+            for word in normalized.split():
+                entry_ids = self._words.get(word)
+                if entry_ids is None:
+                    continue
+                entry_ids.discard(entry_id)
+                if not entry_ids:
+                    self._forget_word(word)
+            return True
+
+    def entry(self, entry_id: int) -> str:
+        return self._entries[entry_id]
+
+    def cache_stats(self) -> dict[str, int]:
+        with self.lock:
+            return {**self._stats, "size": len(self._cache), "capacity": self.cache_size}
+
+    def search_ids(self, term: str) -> list[int]:
+        with self.lock:
+            return list(self._lookup(normalize(term)))
+
+    def search(self, term: str) -> list[str]:
+        with self.lock:
+            return [self._entries[entry_id] for entry_id in self._lookup(normalize(term))]
+
+    def ranked(
+        self, term: str, limit: int = 10, cursor: str | None = None
+    ) -> tuple[list[str], str | None]:
+        """Return one page of matches ordered by relevance, plus the next cursor.
+
+        Matches rank as prefix, then word boundary, then plain substring, and
+        ties break on length and catalog order. ``heapq.nsmallest`` selects
+        ``limit + 1`` keys past the cursor, so the full match set is never
+        sorted. The cursor is the last key of the page, which keeps paging
+        stable while other entries are added or removed. An empty term lists
+        the catalog in order, so its page is just the next ids.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        term = normalize(term)
+        with self.lock:
+            if not term:
+                after_id = after[2] if after is not None else -1
+                ids = (entry_id for entry_id in self._entries if entry_id > after_id)
+                page = [(0, 0, entry_id) for entry_id in islice(ids, limit + 1)]
+            else:
+                keys = (self._rank_key(entry_id, term) for entry_id in self._lookup(term))
+                if after is not None:
+                    keys = (key for key in keys if key > after)
+                page = heapq.nsmallest(limit + 1, keys)
+            entries = [self._entries[key[2]] for key in page[:limit]]
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return entries, next_cursor
+
+    def fuzzy(self, term: str, max_distance: int = 1, limit: int = 10) -> list[str] | None:
+        """Match entries whose words are within ``max_distance`` edits of the query.
+
+        Each query word only gets compared with indexed words that share
+        enough of its padded trigrams: ``d`` edits change at most ``3 * d`` of
+        them. A word is allowed at most one edit per three characters, since
+        more edits in a short word match almost anything. The comparison gives
+        up past the allowed distance (see ``edit_distance``). An entry scores the sum of its best per-word
+        distances, and the ``limit`` best entries come back ordered by score,
+        length and catalog order. Returns None when the lookup overruns
+        ``fuzzy_budget`` seconds, so the caller can fall back to exact results.
+        """
+        words = normalize(term).split()
+        if not words:
+            return []
+        deadline = time.monotonic() + self.fuzzy_budget
+        with self.lock:
+            scores: dict[int, int] | None = None
+            for word in words:
+                hits = self._similar_words(word, max_distance, deadline)
+                if hits is None:
+                    self.fuzzy_fallbacks += 1
+                    return None
+                best: dict[int, int] = {}
+                for distance, candidate in hits:
+                    for entry_id in self._words.get(candidate, ()):
+                        if distance < best.get(entry_id, max_distance + 1):
+                            best[entry_id] = distance
+                if scores is None:
+                    scores = best
+                else:
+                    scores = {
+                        entry_id: scores[entry_id] + distance
+                        for entry_id, distance in best.items()
+                        if entry_id in scores
+                    }
+            page = heapq.nsmallest(
+                limit,
+                (
+                    (score, len(self._normalized[entry_id]), entry_id)
+                    for entry_id, score in (scores or {}).items()
+                ),
+            )
+            return [self._entries[key[2]] for key in page]
+
+    def _similar_words(
+        self, word: str, max_distance: int, deadline: float
+    ) -> list[tuple[int, str]] | None:
+        # One edit per three characters keeps ``needed`` positive, so every
+        # candidate shares a trigram with the word.
+        max_distance = min(max_distance, len(word) // 3)
+        grams = word_trigrams(word)
+        needed = len(grams) - 3 * max_distance
+        shared: dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._word_postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        candidates = [candidate for candidate, count in shared.items() if count >= needed]
+        found: list[tuple[int, str]] = []
+        for n, candidate in enumerate(candidates):
+            if n % 256 == 0 and time.monotonic() > deadline:
+                return None
+            distance = edit_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                found.append((distance, candidate))
+        return found
+
+    def _forget_word(self, word: str) -> None:
+        del self._words[word]
+        for gram in word_trigrams(word):
+            posting = self._word_postings.get(gram)
+            if posting is None:
+                continue
+            posting.discard(word)
+            if not posting:
+                del self._word_postings[gram]
+
+    def _rank_key(self, entry_id: int, term: str) -> tuple[int, int, int]:
+        normalized = self._normalized[entry_id]
+        return match_rank(normalized, term), len(normalized), entry_id
+
+    def _lookup(self, term: str) -> tuple[int, ...] | list[int]:
+        if not term or self.cache_size <= 0:
+            return self._match(term)
+        cached = self._cache.get(term)
+        if cached is not None:
+            self._cache.move_to_end(term)
+            self._stats["hits"] += 1
+            return cached
+        self._stats["misses"] += 1
+        for end in range(len(term) - 1, 0, -1):
+            base = self._cache.get(term[:end])
+            if base is not None:
+                self._stats["narrowed"] += 1
+                result = tuple(entry_id for entry_id in base if term in self._normalized[entry_id])
+                break
+        else:
+            result = tuple(self._match(term))
+        self._cache[term] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self._stats["evictions"] += 1
+        return result
+
+    def _match(self, term: str) -> list[int]:
+        if not term:
+            return list(self._entries)
+        grams = trigrams(term)
+        if not grams:
+            return [
+                entry_id for entry_id, normalized in self._normalized.items() if term in normalized
+            ]
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        return sorted(entry_id for entry_id in candidates if term in self._normalized[entry_id])
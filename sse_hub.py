@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+from collections import deque
+from collections.abc import AsyncIterator, Iterable
+from threading import Lock
+from typing import Literal
+
+SlowConsumerPolicy = Literal["drop", "disconnect"]
+HEARTBEAT = b": heartbeat\n\n"
+
+
+def encode_event(event: str, data: str, event_id: int | None = None) -> bytes:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.splitlines() or [""])
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class Subscription:
+    def __init__(self, topics: frozenset[str], buffer_size: int) -> None:
+        self.topics = topics
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = 0
+        self.closed = False
+
+    async def frames(self, heartbeat: float | None = None) -> AsyncIterator[bytes]:
+        """Yield queued frames until closed, or ``HEARTBEAT`` after ``heartbeat`` idle seconds."""
+        while not self.closed:
+            try:
+                frame = await asyncio.wait_for(self.queue.get(), heartbeat)
+            except TimeoutError:
+                frame = HEARTBEAT
+            if self.closed:
+                return
+            yield frame
+
+    def close(self) -> None:
+        self.closed = True
+        if self.queue.empty():
+            self.queue.put_nowait(b"")
+
+
+class BroadcastHub:
+    """In-process fan-out of pre-encoded SSE frames over named topics.
+
+    ``publish`` encodes an event once. The event gets a hub-wide increasing
+    id and the topic name as its ``event:`` field, and the frame is appended
+    to the topic's ring buffer (``history`` frames). An id assigned upstream
+    (by the backplane, the same in every worker) is kept as long as it
+    increases; local events take the next id.
+
+    A subscription listens to a set of topics multiplexed on one stream.
+    ``subscribe`` replays every buffered frame newer than ``last_event_id``,
+    merged across topics in id order, and the subscriber's queue grows to
+    fit the whole replay. Without an id, only the latest frame of each topic
+    is replayed. If the requested id has already been pushed out of a
+    topic's ring, a ``reset`` event naming the topic tells the client to
+    refetch.
+
+    Every subscriber has its own bounded queue. When a queue is full, the
+    ``policy`` decides: ``"drop"`` discards that subscriber's oldest frame,
+    ``"disconnect"`` closes the subscription so its stream ends. One slow
+    client never blocks the producer or other subscribers.
+
+    Queues belong to the event loop. ``publish_threadsafe`` hands events
+    from worker threads (sync route handlers) to the loop.
+    """
+
+    def __init__(
+        self,
+        topics: Iterable[str],
+        buffer_size: int = 16,
+        history: int = 64,
+        policy: SlowConsumerPolicy = "drop",
+    ) -> None:
+        self.buffer_size = buffer_size
+        self.policy = policy
+        self._lock = Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._last_id = 0
+        self._rings: dict[str, deque[tuple[int, bytes]]] = {
+            topic: deque(maxlen=history) for topic in topics
+        }
+        self._evicted_upto: dict[str, int] = {topic: 0 for topic in self._rings}
+        self._subscribers: set[Subscription] = set()
+        self._stats = {"published": 0, "dropped": 0, "disconnected": 0, "replayed": 0}
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def topics(self) -> frozenset[str]:
+        return frozenset(self._rings)
+
+    def has_subscribers(self, topic: str) -> bool:
+        return any(topic in subscription.topics for subscription in self._subscribers)
+
+    def subscribe(
+        self, topics: Iterable[str], last_event_id: int | None = None
+    ) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        topics = frozenset(topics) & self.topics
+        with self._lock:
+            backlog = self._backlog(topics, last_event_id)
+        # The queue holds the whole replay, resets included, so none of it is cut.
+        subscription = Subscription(topics, max(self.buffer_size, len(backlog)))
+        for frame in backlog:
+            subscription.queue.put_nowait(frame)
+        self._stats["replayed"] += len(backlog)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.close()
+        self._subscribers.discard(subscription)
+
+    def publish(self, topic: str, data: str, event_id: int | None = None) -> int:
+        with self._lock:
+            if event_id is None or event_id <= self._last_id:
+                event_id = self._last_id + 1
+            self._last_id = event_id
+            frame = encode_event(topic, data, event_id)
+            ring = self._rings[topic]
+            if len(ring) == ring.maxlen:
+                self._evicted_upto[topic] = ring[0][0]
+            ring.append((event_id, frame))
+        self._stats["published"] += 1
+        for subscription in list(self._subscribers):
+            if topic in subscription.topics:
+                self._deliver(subscription, frame)
+        return event_id
+
+    def publish_threadsafe(self, topic: str, data: str, event_id: int | None = None) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self.publish(topic, data, event_id)
+        else:
+            loop.call_soon_threadsafe(self.publish, topic, data, event_id)
+
+    def stats(self) -> dict[str, int | str]:
+        return {
+            **self._stats,
+            "subscribers": len(self._subscribers),
+            "last_event_id": self._last_id,
+            "policy": self.policy,
+        }
+
+    def _backlog(self, topics: frozenset[str], last_event_id: int | None) -> list[bytes]:
+        if last_event_id is None:
+            latest = [self._rings[topic][-1] for topic in topics if self._rings[topic]]
+            return [frame for _, frame in sorted(latest)]
+        resets = [
+            encode_event("reset", topic)
+            for topic in sorted(topics)
+            if last_event_id < self._evicted_upto[topic]
+        ]
+        replay = heapq.merge(
+            *(
+                [entry for entry in self._rings[topic] if entry[0] > last_event_id]
+                for topic in topics
+            )
+        )
+        return resets + [frame for _, frame in replay]
+
+    def _deliver(self, subscription: Subscription, frame: bytes) -> None:
+        try:
+            subscription.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.policy == "disconnect":
+            self._stats["disconnected"] += 1
+            self.unsubscribe(subscription)
+            return
+        subscription.queue.get_nowait()
+        subscription.queue.put_nowait(frame)
+        subscription.dropped += 1
+        self._stats["dropped"] += 1
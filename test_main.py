@@ -3,7 +3,12 @@
 import pytest
 from fastapi.testclient import TestClient
 
-from main import app, todos, counter_value, counter_lock, todos_lock, next_todo_id
+from async_jobs import JobRegistry, TimerScheduler
+from main import app, counter_lock
+from search_index import SearchIndex, edit_distance
+from sse_hub import BroadcastHub
+from todo_store import SQLiteTodoBackend, TodoStore
+from ws_rooms import RoomHub, split_oob
 
 
 @pytest.fixture
@@ -14,18 +19,17 @@ def client():
 @pytest.fixture(autouse=True)
 def reset_state():
     """Reset global state before each test."""
-    global counter_value, next_todo_id
+    import main
     with counter_lock:
-        import main
         main.counter_value = 0
-    with todos_lock:
-        import main
-        main.todos[:] = [
+    main.todos.reset(
+        [
             {"id": 1, "text": "Skim the HTMX docs", "done": False},
             {"id": 2, "text": "Wire a form with hx-post", "done": False},
             {"id": 3, "text": "Try hx-swap-oob", "done": True},
         ]
-        main.next_todo_id = 4
+    )
+    main._bump_home_version()
     yield
 
 
@@ -36,12 +40,70 @@ class TestHomeAndNavigation:
         assert "HTMX Teaching App" in response.text
         assert "hx-get" in response.text
 
+    def test_home_page_references_guides_payload(self, client):
+        import main
+        response = client.get("/")
+        assert main._guides_url() in response.text
+        assert "def hello(request" not in response.text
+
+    def test_home_page_is_cached_until_todos_change(self, client):
+        import main
+        client.get("/")
+        cached = main._home_cache
+        client.get("/")
+        assert main._home_cache is cached
+
+        client.post("/todos", data={"text": "Fresh task"})
+        response = client.get("/")
+        assert main._home_cache is not cached
+        assert "Fresh task" in response.text
+
+    def test_home_page_gzip_variant(self, client):
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "HTMX Teaching App" in response.text
+
+    def test_home_page_honours_gzip_q_values(self, client):
+        import main
+
+        for header in ("gzip;q=0", "gzip; q=0.0, identity", "*;q=0", "br", "gzip;q=0, *"):
+            response = client.get("/", headers={"Accept-Encoding": header})
+            assert "Content-Encoding" not in response.headers, header
+        assert main._accepts_gzip("deflate, gzip;q=0.5")
+        assert main._accepts_gzip("*")
+
+    def test_server_time_fragment(self, client):
+        response = client.get("/server-time")
+        assert response.status_code == 200
+
     def test_about_page_loads(self, client):
         response = client.get("/page/about")
         assert response.status_code == 200
         assert "About This Demo" in response.text
 
 
+class TestGuidesPayload:
+    def test_guides_payload_is_immutable(self, client):
+        import main
+        response = client.get(main._guides_url())
+        assert response.status_code == 200
+        assert "demo-hx-get" in response.json()
+        assert "immutable" in response.headers["Cache-Control"]
+        assert response.headers["ETag"] == f'"{main._GUIDES_DIGEST}"'
+
+    def test_guides_payload_not_modified(self, client):
+        import main
+        response = client.get(
+            main._guides_url(),
+            headers={"If-None-Match": f'"{main._GUIDES_DIGEST}"'},
+        )
+        assert response.status_code == 304
+
+    def test_guides_payload_unknown_digest(self, client):
+        response = client.get("/guides/deadbeef.json")
+        assert response.status_code == 404
+
+
 class TestHelloEndpoint:
     def test_hello_default_name(self, client):
         response = client.get("/hello")
@@ -80,6 +142,130 @@ class TestSearch:
         response = client.get("/search?q=xyznonexistent")
         assert response.status_code == 200
 
+    def test_search_ranks_and_paginates(self, client):
+        response = client.get("/search?q=s&limit=3")
+        assert response.status_code == 200
+        assert "Load more" in response.text
+        assert "cursor=" in response.text
+
+    def test_search_fuzzy_mode_keeps_partial_word_matches(self, client):
+        response = client.get("/search?q=hyper&mode=fuzzy")
+        assert "Hypermedia" in response.text
+        assert "No matches" not in response.text
+
+    def test_search_mode_checkbox_reruns_search(self, client):
+        response = client.get("/")
+        assert 'hx-trigger="change"' in response.text
+        assert 'hx-include="#search-q"' in response.text
+
+    def test_search_fuzzy_mode_tolerates_typos(self, client):
+        response = client.get("/search?q=polilng&mode=fuzzy&distance=2")
+        assert "Polling" in response.text
+
+    def test_search_rejects_bad_cursor(self, client):
+        response = client.get("/search?q=s&cursor=nope")
+        assert response.status_code == 400
+
+    def test_search_cache_stats_exposed(self, client):
+        client.get("/search?q=poll")
+        stats = client.get("/stats").json()["search_cache"]
+        assert {"hits", "misses", "narrowed", "evictions", "size"} <= stats.keys()
+
+
+class TestSearchIndex:
+    def test_matches_linear_scan(self):
+        import main
+        index = SearchIndex(main.catalog)
+        for term in ["a", "in", "ing", "Poll", "out of", "ss", "zzz", "tions"]:
+            expected = [item for item in main.catalog if term.lower() in item.lower()]
+            assert index.search(term) == expected
+
+    def test_incremental_add_and_remove(self):
+        index = SearchIndex(["Polling", "Lazy Loading"])
+        added = index.add("Long Polling")
+        assert index.search("polling") == ["Polling", "Long Polling"]
+        assert index.remove(added) is True
+        assert index.remove(added) is False
+        assert index.search("polling") == ["Polling"]
+
+    def test_cache_narrows_from_longest_prefix(self):
+        import main
+        index = SearchIndex(main.catalog, cache_size=2)
+        index.search("po")
+        assert index.search("pol") == ["Polling"]
+        assert index.search("pol") == ["Polling"]
+        index.search("zzz")
+        stats = index.cache_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 3
+        assert stats["narrowed"] == 1
+        assert stats["evictions"] == 1
+        assert stats["size"] == 2
+
+    def test_ranked_orders_prefix_then_word_boundary_then_substring(self):
+        index = SearchIndex(["Long Polling", "Unpolled", "Polling", "Pollster"])
+        entries, cursor = index.ranked("poll", limit=10)
+        assert entries == ["Polling", "Pollster", "Long Polling", "Unpolled"]
+        assert cursor is None
+
+    def test_ranked_keyset_pages_cover_all_matches(self):
+        import main
+        index = SearchIndex(main.catalog)
+        expected, _ = index.ranked("s", limit=100)
+        seen, cursor = index.ranked("s", limit=4)
+        while cursor:
+            page, cursor = index.ranked("s", limit=4, cursor=cursor)
+            seen.extend(page)
+        assert seen == expected
+        assert sorted(seen) == sorted(item for item in main.catalog if "s" in item.lower())
+
+    def test_empty_query_pages_through_catalog_in_order(self):
+        index = SearchIndex(f"entry {n}" for n in range(20))
+        index.remove(3)
+        seen, cursor = index.ranked("", limit=5)
+        while cursor:
+            page, cursor = index.ranked("", limit=5, cursor=cursor)
+            seen.extend(page)
+        assert seen == [f"entry {n}" for n in range(20) if n != 3]
+
+    def test_fuzzy_matches_within_distance(self):
+        import main
+        index = SearchIndex(main.catalog)
+        assert index.fuzzy("lazzy loadin", max_distance=1) == ["Lazy Loading"]
+        assert index.fuzzy("pollnig", max_distance=1) == []
+        assert index.fuzzy("pollnig", max_distance=2) == ["Polling"]
+
+    def test_edit_distance_stops_at_limit(self):
+        assert edit_distance("kitten", "sitting") == 3
+        assert edit_distance("kitten", "sitting", limit=3) == 3
+        assert edit_distance("kitten", "sitting", limit=1) == 2
+        assert edit_distance("ab", "abcdef", limit=2) == 3
+
+    def test_fuzzy_finds_typos_in_a_large_catalog_within_budget(self):
+        import random
+        import string
+
+        rng = random.Random(7)
+        words = sorted({"".join(rng.choices(string.ascii_lowercase, k=8)) for _ in range(50_000)})
+        index = SearchIndex(f"{word} {rng.choice(words)}" for word in words)
+        target = words[12_345]
+        typo = target[:3] + target[4:] + "x"
+        assert edit_distance(typo, target) == 2
+        assert target in {entry.split()[0] for entry in index.fuzzy(typo, max_distance=2)}
+        assert index.fuzzy_fallbacks == 0
+
+    def test_fuzzy_falls_back_when_budget_exceeded(self):
+        import main
+        index = SearchIndex(main.catalog, fuzzy_budget=-1)
+        assert index.fuzzy("polling") is None
+        assert index.fuzzy_fallbacks == 1
+
+    def test_cache_is_cleared_when_catalog_changes(self):
+        index = SearchIndex(["Polling"])
+        assert index.search("poll") == ["Polling"]
+        index.add("Long Polling")
+        assert index.search("poll") == ["Polling", "Long Polling"]
+
 
 class TestFormValidation:
     def test_validate_valid_email_and_zip(self, client):
@@ -148,6 +334,27 @@ class TestTodos:
         response = client.put("/todos/1")
         assert response.status_code == 200
 
+    def test_toggle_returns_only_affected_row(self, client):
+        response = client.put("/todos/1")
+        assert 'id="todo-1"' in response.text
+        assert "todo-2" not in response.text
+        assert "2 of 3 done" in response.text
+
+    def test_toggle_out_of_filtered_view_drops_row(self, client):
+        response = client.put("/todos/1", data={"status": "active"})
+        assert "todo-1" not in response.text
+        assert "2 of 3 done" in response.text
+        response = client.put("/todos/1", data={"status": "active"})
+        assert 'id="todo-1"' in response.text
+        response = client.put("/todos/3", data={"status": "done"})
+        assert "todo-3" not in response.text
+        assert 'hx-include="#todo-status"' in client.get("/todos").text
+
+    def test_delete_returns_summary_update(self, client):
+        response = client.delete("/todos/3")
+        assert 'id="todo-summary" class="muted" hx-swap-oob="true"' in response.text
+        assert "0 of 2 done" in response.text
+
     def test_toggle_nonexistent_todo(self, client):
         response = client.put("/todos/999")
         assert response.status_code == 404
@@ -161,6 +368,165 @@ class TestTodos:
         response = client.delete("/todos/999")
         assert response.status_code == 404
 
+    def test_list_todos_keyset_pages(self, client):
+        response = client.get("/todos?limit=2")
+        assert response.status_code == 200
+        assert "todo-1" in response.text and "todo-2" in response.text
+        assert 'hx-trigger="revealed"' in response.text
+        assert "after=2&until=3" in response.text
+
+        response = client.get("/todos?after=2&until=3&limit=2")
+        assert "todo-3" in response.text
+        assert 'hx-trigger="revealed"' not in response.text
+
+    def test_list_todos_filters(self, client):
+        response = client.get("/todos?status=done")
+        assert "Try hx-swap-oob" in response.text
+        assert "Skim the HTMX docs" not in response.text
+
+        client.put("/todos/1")
+        response = client.get("/todos?status=active")
+        assert "Skim the HTMX docs" not in response.text
+        assert "Wire a form with hx-post" in response.text
+
+    def test_new_rows_append_after_paged_rows(self, client):
+        response = client.get("/todos?limit=2")
+        pages = response.text.index('id="todo-pages"')
+        sentinel = response.text.index('hx-trigger="revealed"')
+        tail = response.text.index('id="todo-new"')
+        assert pages < sentinel < tail
+        assert 'id="todo-status" name="status" value="all"' in response.text
+
+    def test_add_in_done_view_skips_row(self, client):
+        response = client.post("/todos", data={"text": "Hidden here", "status": "done"})
+        assert "Hidden here" not in response.text
+        assert "1 of 4 done" in response.text
+
+    def test_list_todos_excludes_items_after_until(self, client):
+        client.post("/todos", data={"text": "Appended live"})
+        response = client.get("/todos?until=3")
+        assert "Appended live" not in response.text
+
+
+class TestTodoStore:
+    def test_preserves_insertion_order_after_delete(self):
+        store = TodoStore()
+        first = store.add("one")
+        store.add("two")
+        store.add("three")
+        store.delete(first["id"])
+        assert [todo["text"] for todo in store] == ["two", "three"]
+
+    def test_toggle_and_missing_ids(self):
+        store = TodoStore([{"id": 7, "text": "seed", "done": False}])
+        assert store.toggle(7)["done"] is True
+        assert store.toggle(99) is None
+        assert store.delete(99) is None
+        assert store.add("next")["id"] == 8
+
+
+class TestSQLiteTodoBackend:
+    def test_survives_restart(self, tmp_path):
+        path = str(tmp_path / "todos.sqlite3")
+        backend = SQLiteTodoBackend(path)
+        store = TodoStore([{"id": 1, "text": "seed", "done": False}], backend=backend)
+        added = store.add("persisted")
+        store.toggle(1)
+        backend.close()
+
+        reopened = TodoStore([], backend=SQLiteTodoBackend(path))
+        assert [(todo["text"], todo["done"]) for todo in reopened] == [
+            ("seed", True),
+            ("persisted", False),
+        ]
+        assert reopened.get(added["id"]) is not None
+
+    def test_stores_share_writes(self, tmp_path):
+        path = str(tmp_path / "todos.sqlite3")
+        first = TodoStore([], backend=SQLiteTodoBackend(path))
+        second = TodoStore([], backend=SQLiteTodoBackend(path))
+        todo = first.add("from worker one")
+        assert second.get(todo["id"])["text"] == "from worker one"
+        assert second.toggle(todo["id"])["done"] is True
+        assert first.counts()["done"] == 1
+        assert second.delete(todo["id"]) is not None
+        assert first.counts()["total"] == 0
+
+    def test_other_workers_changes_are_applied_incrementally(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "todos.sqlite3")
+        seeds = [{"id": n, "text": f"seed {n}", "done": False} for n in range(1, 4)]
+        first = TodoStore(seeds, backend=SQLiteTodoBackend(path))
+        backend = SQLiteTodoBackend(path)
+        second = TodoStore([], backend=backend)
+
+        def full_reload():
+            raise AssertionError("full reload")
+
+        monkeypatch.setattr(backend, "load", full_reload)
+        added = first.add("new")
+        first.toggle(2)
+        first.delete(1)
+        assert [(todo["id"], todo["done"]) for todo in second.all()] == [
+            (2, True),
+            (3, False),
+            (added["id"], False),
+        ]
+        assert second.counts() == {"total": 3, "active": 2, "done": 1}
+        assert second.page("done")[0] == [second.get(2)]
+
+    def test_trimmed_change_log_falls_back_to_reload(self, tmp_path):
+        path = str(tmp_path / "todos.sqlite3")
+        first = TodoStore([], backend=SQLiteTodoBackend(path, log_size=2))
+        second = TodoStore([], backend=SQLiteTodoBackend(path))
+        for n in range(5):
+            first.add(f"task {n}")
+        first.delete(1)
+        assert [todo["text"] for todo in second.all()] == [f"task {n}" for n in range(1, 5)]
+
+    def test_reads_do_not_wait_for_the_writer(self, tmp_path):
+        from threading import Thread
+
+        backend = SQLiteTodoBackend(str(tmp_path / "todos.sqlite3"))
+        store = TodoStore([{"id": 1, "text": "seed", "done": False}], backend=backend)
+        results = []
+        with backend._conn_lock:
+            reader = Thread(target=lambda: results.append(store.counts()))
+            reader.start()
+            reader.join(timeout=2)
+        assert results == [{"total": 1, "active": 1, "done": 0}]
+
+    def test_concurrent_writes_are_group_committed(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+
+        backend = SQLiteTodoBackend(str(tmp_path / "todos.sqlite3"))
+        store = TodoStore([], backend=backend)
+        writes_before = backend.writes
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            added = list(pool.map(store.add, [f"task {n}" for n in range(64)]))
+        assert len({todo["id"] for todo in added}) == 64
+        assert store.counts()["total"] == 64
+        assert backend.writes - writes_before == 64
+        assert backend.commits <= backend.writes
+
+    def test_concurrent_toggles_apply_in_commit_order(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+
+        path = str(tmp_path / "todos.sqlite3")
+        backend = SQLiteTodoBackend(path)
+        store = TodoStore([{"id": 1, "text": "flip", "done": False}], backend=backend)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: store.toggle(1), range(101)))
+        on_disk = TodoStore([], backend=SQLiteTodoBackend(path)).get(1)
+        assert store.get(1)["done"] is on_disk["done"] is True
+
+    def test_emptied_list_is_not_reseeded(self, tmp_path):
+        path = str(tmp_path / "todos.sqlite3")
+        seeds = [{"id": 1, "text": "seed", "done": False}]
+        store = TodoStore(seeds, backend=SQLiteTodoBackend(path))
+        store.delete(1)
+        reopened = TodoStore(seeds, backend=SQLiteTodoBackend(path))
+        assert len(reopened) == 0
+
 
 class TestSelectAndSync:
     def test_select_demo(self, client):
@@ -351,6 +717,58 @@ class TestSlowEndpoint:
         response = client.get("/slow")
         assert response.status_code == 200
 
+    def test_disconnect_cancels_handler(self):
+        import asyncio
+        import main
+
+        rendered = []
+
+        class GoneRequest:
+            async def is_disconnected(self):
+                return True
+
+        @main.cancel_on_disconnect
+        async def handler(request):
+            await asyncio.sleep(5)
+            rendered.append(True)
+
+        before = main.cancellation_stats["cancelled"]
+        response = asyncio.run(handler(request=GoneRequest()))
+        assert response.status_code == 499
+        assert rendered == []
+        assert main.cancellation_stats["cancelled"] == before + 1
+
+    def test_cancelled_wrapper_cancels_handler(self):
+        import asyncio
+        import main
+
+        class ConnectedRequest:
+            async def is_disconnected(self):
+                return False
+
+        handlers = []
+
+        @main.cancel_on_disconnect
+        async def handler(request):
+            handlers.append(asyncio.current_task())
+            await asyncio.sleep(5)
+
+        async def run():
+            wrapper = asyncio.ensure_future(handler(request=ConnectedRequest()))
+            await asyncio.sleep(0.05)
+            wrapper.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await wrapper
+            await asyncio.sleep(0)
+            return handlers[0].cancelled()
+
+        assert asyncio.run(run())
+
+    def test_cancellation_stats_exposed(self, client):
+        client.get("/slow")
+        stats = client.get("/stats").json()["cancellation"]
+        assert stats["completed"] >= 1
+
 
 class TestRequestInfo:
     def test_request_info(self, client):
@@ -377,3 +795,793 @@ class TestJinjaTemplates:
         response = client.get("/jinja-inheritance")
         assert response.status_code == 200
         assert "Inherited Fragment" in response.text
+
+
+class TestAsyncDashboard:
+    def test_poll_unknown_run_reports_done(self, client):
+        response = client.get("/async-dashboard/poll?run_id=missing")
+        assert response.status_code == 286
+        assert "All workers finished." in response.text
+
+    def test_poll_returns_new_tiles(self, client):
+        import main
+        run_id = main.async_runs.create(total=2)
+        main.async_runs.append_result(
+            run_id,
+            {"worker_id": 1, "duration": 3, "completed_at": "10:00:00", "summary": "one"},
+        )
+        response = client.get(f"/async-dashboard/poll?run_id={run_id}&offset=0")
+        assert "Worker 1" in response.text
+        assert 'value="1"' in response.text
+        assert "All workers finished." not in response.text
+
+    def test_poll_finished_run_stops_polling(self, client):
+        run_id = self._finished_run()
+        response = client.get(f"/async-dashboard/poll?run_id={run_id}&offset=1&wait=5")
+        assert response.status_code == 286
+        assert "Worker 2" in response.text
+        assert "Worker 1" not in response.text
+
+    def test_long_poll_times_out_without_new_tiles(self, client):
+        import main
+        run_id = main.async_runs.create(total=2)
+        response = client.get(f"/async-dashboard/poll?run_id={run_id}&wait=0.05")
+        assert response.status_code == 200
+        assert 'value="0"' in response.text
+
+    def _finished_run(self):
+        import main
+        run_id = main.async_runs.create(total=2)
+        for worker_id in (1, 2):
+            main.async_runs.append_result(
+                run_id,
+                {
+                    "worker_id": worker_id,
+                    "duration": 3,
+                    "completed_at": "10:00:00",
+                    "summary": f"Worker {worker_id} done",
+                },
+            )
+        return run_id
+
+    def test_stream_pushes_tiles_then_done(self, client):
+        run_id = self._finished_run()
+        response = client.get(f"/async-dashboard/stream?run_id={run_id}")
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert "id: 1\nevent: tile" in response.text
+        assert "id: 2\nevent: tile" in response.text
+        assert response.text.rstrip().endswith("All workers finished.</div>")
+
+    def test_stream_resumes_from_last_event_id(self, client):
+        run_id = self._finished_run()
+        response = client.get(
+            f"/async-dashboard/stream?run_id={run_id}",
+            headers={"Last-Event-ID": "1"},
+        )
+        assert "Worker 1" not in response.text
+        assert "id: 2\nevent: tile" in response.text
+
+
+class TestJobRegistry:
+    def test_evicts_idle_runs_and_enforces_capacity(self):
+        now = [0.0]
+        registry = JobRegistry(lambda payload: b"tile", max_runs=2, ttl=10, clock=lambda: now[0])
+        first = registry.create(total=1)
+        second = registry.create(total=1)
+        registry.get(first)
+        registry.create(total=1)
+        assert registry.get(second) is None
+        assert registry.get(first) is not None
+
+        now[0] = 20.0
+        registry.create(total=1)
+        stats = registry.stats()
+        assert stats["size"] == 1
+        assert stats["evicted_capacity"] == 1
+        assert stats["evicted_expired"] == 2
+
+    def test_results_are_stored_as_rendered_tiles(self):
+        rendered = []
+
+        def render_tile(payload):
+            rendered.append(payload["n"])
+            return f"<b>{payload['n']}</b>".encode()
+
+        registry = JobRegistry(render_tile)
+        run_id = registry.create(total=2)
+        registry.append_result(run_id, {"n": 1})
+        registry.append_result(run_id, {"n": 2})
+        registry.get(run_id)
+        assert registry.get(run_id)["tiles"] == [b"<b>1</b>", b"<b>2</b>"]
+        assert rendered == [1, 2]
+
+    def test_wait_for_change_wakes_on_append(self):
+        import asyncio
+
+        registry = JobRegistry(lambda payload: b"tile")
+        run_id = registry.create(total=2)
+
+        async def run():
+            waiter = asyncio.create_task(registry.wait_for_change(run_id, 0, timeout=5))
+            await asyncio.sleep(0)
+            registry.append_result(run_id, {"n": 1})
+            return await waiter, await registry.wait_for_change(run_id, 1, timeout=0.01)
+
+        assert asyncio.run(run()) == (True, False)
+
+
+class TestTimerScheduler:
+    def test_caps_active_timers_and_drains_queue(self):
+        import asyncio
+
+        fired = []
+
+        async def run():
+            scheduler = TimerScheduler(max_active=2)
+            for n in range(5):
+                scheduler.schedule(0.01, fired.append, n)
+            assert scheduler.stats()["active"] == 2
+            assert scheduler.stats()["waiting"] == 3
+            await asyncio.sleep(0.2)
+            return scheduler.stats()
+
+        stats = asyncio.run(run())
+        assert fired == [0, 1, 2, 3, 4]
+        assert stats["completed"] == 5
+        assert stats["queued"] == 3
+        assert stats["active"] == 0
+
+
+class TestBroadcastHub:
+    def test_fans_out_by_topic_with_event_ids(self):
+        import asyncio
+
+        async def run():
+            hub = BroadcastHub(("ticks", "todos"), buffer_size=4)
+            ticks = hub.subscribe(["ticks"])
+            both = hub.subscribe(["ticks", "todos"])
+            hub.publish("ticks", "tick-1")
+            hub.publish("todos", "todo-1")
+            return (
+                [ticks.queue.get_nowait()],
+                [both.queue.get_nowait(), both.queue.get_nowait()],
+                ticks.queue.empty(),
+            )
+
+        ticks, both, drained = asyncio.run(run())
+        assert ticks == [b"id: 1\nevent: ticks\ndata: tick-1\n\n"]
+        assert both == [ticks[0], b"id: 2\nevent: todos\ndata: todo-1\n\n"]
+        assert drained
+
+    def test_replays_from_last_event_id_across_topics(self):
+        import asyncio
+
+        async def run():
+            hub = BroadcastHub(("ticks", "todos", "jobs"), buffer_size=8)
+            for topic in ("ticks", "todos", "jobs", "todos", "ticks"):
+                hub.publish(topic, topic)
+            fresh = hub.subscribe(["ticks", "todos"])
+            resumed = hub.subscribe(["ticks", "todos"], last_event_id=2)
+            return (
+                [fresh.queue.get_nowait() for _ in range(fresh.queue.qsize())],
+                [resumed.queue.get_nowait() for _ in range(resumed.queue.qsize())],
+            )
+
+        fresh, resumed = asyncio.run(run())
+        assert [frame.split(b"\n")[0] for frame in fresh] == [b"id: 4", b"id: 5"]
+        assert [frame.split(b"\n")[0] for frame in resumed] == [b"id: 4", b"id: 5"]
+
+    def test_resume_past_ring_sends_reset(self):
+        import asyncio
+
+        async def run():
+            hub = BroadcastHub(("ticks",), buffer_size=8, history=2)
+            for n in range(4):
+                hub.publish("ticks", f"tick-{n}")
+            resumed = hub.subscribe(["ticks"], last_event_id=1)
+            return [resumed.queue.get_nowait() for _ in range(resumed.queue.qsize())]
+
+        frames = asyncio.run(run())
+        assert frames[0] == b"event: reset\ndata: ticks\n\n"
+        assert [frame.split(b"\n")[0] for frame in frames[1:]] == [b"id: 3", b"id: 4"]
+
+    def test_upstream_event_ids_are_kept(self):
+        import asyncio
+
+        async def run():
+            hub = BroadcastHub(("todos", "ticks"), buffer_size=8)
+            hub.publish("todos", "first", event_id=1000)
+            hub.publish("ticks", "local")
+            hub.publish("todos", "stale", event_id=5)
+            resumed = hub.subscribe(["todos", "ticks"], last_event_id=1000)
+            return [resumed.queue.get_nowait() for _ in range(resumed.queue.qsize())]
+
+        frames = asyncio.run(run())
+        assert [frame.split(b"\n")[0] for frame in frames] == [b"id: 1001", b"id: 1002"]
+
+    def test_replay_longer_than_buffer_is_not_truncated(self):
+        import asyncio
+
+        async def run():
+            hub = BroadcastHub(("ticks",), buffer_size=2, history=4)
+            for n in range(6):
+                hub.publish("ticks", f"tick-{n}")
+            resumed = hub.subscribe(["ticks"], last_event_id=1)
+            return [resumed.queue.get_nowait() for _ in range(resumed.queue.qsize())]
+
+        frames = asyncio.run(run())
+        assert frames[0] == b"event: reset\ndata: ticks\n\n"
+        assert [frame.split(b"\n")[0] for frame in frames[1:]] == [
+            b"id: 3",
+            b"id: 4",
+            b"id: 5",
+            b"id: 6",
+        ]
+
+    def test_drop_policy_discards_oldest_frame(self):
+        import asyncio
+
+        async def run():
+            hub = BroadcastHub(("ticks",), buffer_size=2, policy="drop")
+            slow = hub.subscribe(["ticks"])
+            for n in range(4):
+                hub.publish("ticks", f"tick-{n}")
+            return [slow.queue.get_nowait(), slow.queue.get_nowait()], slow.dropped
+
+        frames, dropped = asyncio.run(run())
+        assert [frame.split(b"\n")[-3] for frame in frames] == [b"data: tick-2", b"data: tick-3"]
+        assert dropped == 2
+
+    def test_disconnect_policy_closes_slow_subscriber(self):
+        import asyncio
+
+        async def run():
+            hub = BroadcastHub(("ticks",), buffer_size=1, policy="disconnect")
+            slow = hub.subscribe(["ticks"])
+            hub.publish("ticks", "tick-1")
+            hub.publish("ticks", "tick-2")
+            frames = [frame async for frame in slow.frames()]
+            return frames, len(hub), hub.stats()["disconnected"]
+
+        assert asyncio.run(run()) == ([], 0, 1)
+
+    def test_todo_changes_are_published(self, client):
+        import main
+
+        before = main.sse_hub.stats()["last_event_id"]
+        client.post("/todos", data={"text": "<b>Streamed</b>"})
+        frames = main.sse_hub._backlog(frozenset({"todos"}), before)
+        assert len(frames) == 1
+        assert b"event: todos" in frames[0]
+        assert b"&lt;b&gt;Streamed&lt;/b&gt;" in frames[0]
+
+    def test_unknown_topics_are_rejected(self, client):
+        response = client.get("/sse?topics=nope")
+        assert response.status_code == 400
+
+    def test_idle_subscription_emits_heartbeat(self):
+        import asyncio
+
+        from sse_hub import HEARTBEAT
+
+        async def run():
+            hub = BroadcastHub(("ticks",))
+            subscription = hub.subscribe(["ticks"])
+            frames = subscription.frames(heartbeat=0.01)
+            first = await anext(frames)
+            hub.unsubscribe(subscription)
+            rest = [frame async for frame in frames]
+            return first, rest
+
+        assert asyncio.run(run()) == (HEARTBEAT, [])
+
+
+class TestSSEStreams:
+    def test_disconnected_client_is_reaped(self):
+        import asyncio
+        import main
+
+        class GoneRequest:
+            headers = {}
+
+            async def is_disconnected(self):
+                return True
+
+        async def run():
+            response = await main.sse(GoneRequest(), topics="todos")
+            async for _ in response.body_iterator:
+                pass
+            return len(main.sse_hub)
+
+        before = main.sse_streams["reaped"]
+        assert asyncio.run(run()) == 0
+        assert main.sse_streams["reaped"] == before + 1
+        assert main.sse_streams["open"] == 0
+
+    def test_stream_cap_returns_503(self, client, monkeypatch):
+        import main
+
+        monkeypatch.setattr(main, "SSE_MAX_STREAMS", 0)
+        response = client.get("/sse")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == str(main.SSE_RETRY_AFTER)
+        stats = client.get("/stats").json()["sse_streams"]
+        assert stats["rejected"] >= 1
+        assert stats["max"] == 0
+
+
+    def test_stream_slot_is_reserved_before_the_body_starts(self, monkeypatch):
+        import asyncio
+        import main
+
+        from fastapi import HTTPException
+
+        class Idle:
+            headers = {}
+
+        monkeypatch.setattr(main, "SSE_MAX_STREAMS", 1)
+
+        async def run():
+            first = await main.sse(Idle(), topics="todos")
+            with pytest.raises(HTTPException) as burst:
+                await main.sse(Idle(), topics="todos")
+            held = main.sse_streams["open"]
+            await first.background()
+            return burst.value.status_code, held, main.sse_streams["open"]
+
+        assert asyncio.run(run()) == (503, 1, 0)
+
+
+class TestWebSocketRooms:
+    def test_broadcast_reaches_every_room_member(self):
+        with TestClient(app) as client:
+            with (
+                client.websocket_connect("/ws?room=lobby") as first,
+                client.websocket_connect("/ws?room=lobby") as second,
+            ):
+                first.send_text('{"message": "<hi>", "HEADERS": {}}')
+                received = [first.receive_text(), second.receive_text()]
+        assert received[0] == received[1]
+        assert 'hx-swap-oob="beforeend"' in received[0]
+        assert "[lobby]: &lt;hi&gt;" in received[0]
+
+    def test_rooms_are_isolated(self):
+        import asyncio
+
+        async def noop(frame):
+            pass
+
+        async def run():
+            hub = RoomHub()
+            lobby = hub.connect(noop)
+            other = hub.connect(noop)
+            hub.join(lobby, "lobby")
+            hub.join(other, "other")
+            frame = "<div>hello</div>"
+            delivered = hub.broadcast("lobby", frame)
+            return delivered, lobby.queue.get_nowait() is frame, other.queue.empty()
+
+        assert asyncio.run(run()) == (1, True, True)
+
+    def test_full_send_queue_drops_oldest(self):
+        import asyncio
+
+        async def noop(frame):
+            pass
+
+        async def run():
+            hub = RoomHub(queue_size=2)
+            slow = hub.connect(noop)
+            hub.join(slow, "lobby")
+            for n in range(4):
+                hub.broadcast("lobby", f"frame-{n}")
+            hub.disconnect(slow)
+            return [slow.queue.get_nowait(), slow.queue.get_nowait()], hub.stats()
+
+        frames, stats = asyncio.run(run())
+        assert frames == ["frame-2", "frame-3"]
+        assert stats["dropped"] == 2
+        assert stats["rooms"] == 0
+        assert stats["connections"] == 0
+
+    def test_routed_envelope_dispatches_to_http_handler(self, client):
+        import main
+
+        envelope = {
+            "route": "GET /counter",
+            "HEADERS": {"HX-Request": "true", "HX-Target": "ws-counter"},
+        }
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json(envelope)
+            reply = ws.receive_text()
+        assert reply.startswith('<div id="ws-counter" hx-swap-oob="innerHTML">')
+        assert "Counter value: <strong>1</strong>" in reply
+        assert main.counter_value == 1
+
+    def test_routed_todo_form_is_appended(self, client):
+        import main
+
+        envelope = {
+            "route": "POST /todos",
+            "text": "Over the socket",
+            "HEADERS": {"HX-Request": "true", "HX-Target": "todo-new"},
+        }
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json(envelope)
+            reply = ws.receive_text()
+        from html.parser import HTMLParser
+
+        class OobElements(HTMLParser):
+            depth = 0
+            found = []
+
+            def handle_starttag(self, tag, attrs):
+                attrs = dict(attrs)
+                if "hx-swap-oob" in attrs:
+                    self.found.append((self.depth, attrs["id"], attrs["hx-swap-oob"]))
+                self.depth += tag != "input"
+
+            def handle_endtag(self, tag):
+                self.depth -= 1
+
+        parser = OobElements()
+        parser.feed(reply)
+        assert parser.found == [
+            (0, "todo-new", "beforeend"),
+            (0, "todo-error", "true"),
+            (0, "todo-summary", "true"),
+        ]
+        assert "Over the socket" in split_oob(reply)[1].split('<div id="todo-error"')[0]
+        assert [todo["text"] for todo in main.todos][-1] == "Over the socket"
+
+    def test_routed_headers_must_be_hx_strings(self, client):
+        envelope = {"route": "GET /counter", "HEADERS": {"HX-Target": "counter"}}
+        with client.websocket_connect("/ws") as ws:
+            replies = []
+            for headers in ({"Ü✓": "1"}, {"Content-Type": "text/plain"}, {"HX-Trigger": 1}):
+                ws.send_json({**envelope, "HEADERS": {**envelope["HEADERS"], **headers}})
+                replies.append(ws.receive_text())
+            ws.send_json(envelope)
+            replies.append(ws.receive_text())
+        assert all("HEADERS may only carry HX-* string headers" in reply for reply in replies[:3])
+        assert 'id="counter" hx-swap-oob="innerHTML"' in replies[3]
+
+    def test_unknown_route_replies_with_error(self, client):
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json({"route": "GET /sse", "HEADERS": {"HX-Target": "x"}})
+            reply = ws.receive_text()
+        assert "Unsupported route: GET /sse" in reply
+
+    def test_malformed_headers_reply_with_error(self, client):
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json({"route": "POST /todos", "HEADERS": ["HX-Target"]})
+            reply = ws.receive_text()
+            ws.send_json({"message": "still open"})
+            echo = ws.receive_text()
+        assert "HEADERS must be an object" in reply
+        assert "still open" in echo
+
+    def test_disconnect_policy_closes_slow_consumer(self):
+        import asyncio
+
+        async def noop(frame):
+            pass
+
+        async def run():
+            hub = RoomHub(queue_size=1, policy="disconnect")
+            slow = hub.connect(noop)
+            hub.join(slow, "lobby")
+            delivered = [hub.broadcast("lobby", f"frame-{n}") for n in range(3)]
+            hub.disconnect(slow)
+            return delivered, slow.close_reason, hub.stats()["closed"]
+
+        assert asyncio.run(run()) == ([1, 0, 0], "slow_consumer", {"slow_consumer": 1})
+
+    def test_pump_closes_on_stalled_send(self):
+        import asyncio
+
+        from ws_rooms import Connection
+
+        sent = []
+
+        async def record(frame):
+            sent.append(frame)
+            if len(sent) > 1:
+                await asyncio.sleep(60)
+
+        async def run():
+            connection = Connection(record)
+            connection.send("first")
+            connection.send("second")
+            await asyncio.wait_for(connection.pump(send_timeout=0.05), 1)
+            return connection.close_reason
+
+        assert asyncio.run(run()) == "send_timeout"
+        assert sent == ["first", "second"]
+
+    def test_token_bucket_limits_message_rate(self):
+        import asyncio
+
+        from ws_rooms import Connection
+
+        now = [0.0]
+
+        async def noop(frame):
+            pass
+
+        async def run():
+            connection = Connection(noop, rate=1.0, burst=2, clock=lambda: now[0])
+            allowed = [connection.allow() for _ in range(3)]
+            now[0] = 1.0
+            allowed.append(connection.allow())
+            return allowed, connection.throttled
+
+        assert asyncio.run(run()) == ([True, True, False, True], 1)
+
+    def test_rate_limited_socket_gets_notice(self, client, monkeypatch):
+        import main
+
+        monkeypatch.setattr(main.ws_rooms, "burst", 1)
+        monkeypatch.setattr(main.ws_rooms, "rate", 0.0)
+        with client.websocket_connect("/ws?room=limited") as ws:
+            ws.send_text("first")
+            ws.send_text("second")
+            replies = [ws.receive_text(), ws.receive_text()]
+        assert "first" in replies[0]
+        assert "Rate limit exceeded" in replies[1]
+
+    def test_close_reasons_are_counted(self, client):
+        import time
+
+        import main
+
+        before = main.ws_rooms.stats()["closed"].get("client_closed", 0)
+        with client.websocket_connect("/ws") as ws:
+            ws.send_text("bye")
+            ws.receive_text()
+        for _ in range(50):
+            if main.ws_rooms.stats()["closed"].get("client_closed", 0) > before:
+                break
+            time.sleep(0.01)
+        assert main.ws_rooms.stats()["closed"]["client_closed"] == before + 1
+
+    def test_coalesce_merges_adjacent_appends(self):
+        from ws_rooms import coalesce
+
+        wrapper = '<div id="ws-messages" hx-swap-oob="beforeend">'
+        frames = [
+            f'{wrapper}<div class="result">a</div></div>',
+            f'{wrapper}<div class="result">b</div></div>',
+            '<div id="ws-counter" hx-swap-oob="innerHTML">1</div>',
+            f'{wrapper}<div class="result">c</div></div>',
+        ]
+        assert coalesce(frames) == (
+            f'{wrapper}<div class="result">a</div><div class="result">b</div></div>'
+            '<div id="ws-counter" hx-swap-oob="innerHTML">1</div>'
+            f'{wrapper}<div class="result">c</div></div>'
+        )
+
+    def test_coalesce_keeps_frames_with_sibling_oob_elements(self):
+        from ws_rooms import coalesce
+
+        wrapper = '<div id="todo-new" hx-swap-oob="beforeend">'
+        summary = '<div id="todo-summary" hx-swap-oob="true">2 done</div>'
+        frames = [f"{wrapper}<li>a</li></div>{summary}", f"{wrapper}<li>b</li></div>"]
+        assert coalesce(frames) == "".join(frames)
+
+    def test_split_oob_lifts_top_level_oob_elements(self):
+        markup = (
+            '<li id="row"><input type="checkbox"><span hx-swap-oob="true">x</span></li>\n'
+            '<div id="todo-error" hx-swap-oob="true"><br></div>'
+        )
+        assert split_oob(markup) == (
+            '<li id="row"><input type="checkbox"><span hx-swap-oob="true">x</span></li>\n',
+            '<div id="todo-error" hx-swap-oob="true"><br></div>',
+        )
+
+    def test_coalescing_pump_sends_one_message_and_counts_savings(self):
+        import asyncio
+
+        sent = []
+
+        async def record(message):
+            sent.append(message)
+
+        async def run():
+            hub = RoomHub(coalesce_window=0.01, measure_deflate=True)
+            connection = hub.connect(record, deflate=True)
+            hub.join(connection, "lobby")
+            for n in range(5):
+                hub.broadcast(
+                    "lobby",
+                    f'<div id="ws-messages" hx-swap-oob="beforeend"><div>msg {n}</div></div>',
+                )
+            pump = asyncio.ensure_future(connection.pump())
+            await asyncio.sleep(0.05)
+            pump.cancel()
+            return hub.traffic()
+
+        traffic = asyncio.run(run())
+        assert len(sent) == 1
+        assert sent[0].count("hx-swap-oob") == 1
+        assert traffic["frames"] == 5
+        assert traffic["messages"] == 1
+        assert traffic["coalesce_saved_bytes"] > 0
+        assert 0 < traffic["deflate_out"] < traffic["deflate_in"]
+
+    def test_deflate_metrics_sample_connections(self):
+        import asyncio
+
+        async def noop(message):
+            pass
+
+        async def run():
+            hub = RoomHub(measure_deflate=True, deflate_sample=4)
+            connections = [hub.connect(noop, deflate=True) for _ in range(8)]
+            hub.connect(noop, deflate=False)
+            return [connection._deflater is not None for connection in connections]
+
+        assert asyncio.run(run()) == [True, False, False, False] * 2
+
+
+class TestBackplane:
+    def test_in_memory_backplane_delivers_synchronously(self):
+        from backplane import InMemoryBackplane
+
+        received = []
+        backplane = InMemoryBackplane()
+        backplane.start(lambda *event: received.append(event))
+        backplane.publish("sse:todos", "<div>hi</div>")
+        backplane.publish("sse:todos", "<div>again</div>")
+        assert [event[:2] for event in received] == [
+            ("sse:todos", "<div>hi</div>"),
+            ("sse:todos", "<div>again</div>"),
+        ]
+        assert received[0][2] < received[1][2]
+        assert backplane.stats()["delivered"] == 2
+
+    def test_unix_socket_backplane_reaches_every_worker(self, tmp_path):
+        import time
+
+        from backplane import UnixSocketBackplane
+
+        path = str(tmp_path / "backplane.sock")
+        received = {"first": [], "second": []}
+        first = UnixSocketBackplane(path)
+        second = UnixSocketBackplane(path)
+        first.start(lambda *event: received["first"].append(event))
+        second.start(lambda *event: received["second"].append(event))
+        try:
+            assert first.is_broker and not second.is_broker
+            for _ in range(100):
+                if first.stats()["workers"] == 2:
+                    break
+                time.sleep(0.01)
+            for n in range(20):
+                (first, second)[n % 2].publish("sse:todos", f"<div>{n}</div>")
+            for _ in range(200):
+                if len(received["first"]) == len(received["second"]) == 20:
+                    break
+                time.sleep(0.01)
+        finally:
+            second.close()
+            first.close()
+        assert received["first"] == received["second"]
+        assert len(received["first"]) == 20
+        ids = [event_id for _, _, event_id in received["first"]]
+        assert ids == sorted(set(ids))
+
+    def test_malformed_lines_are_counted_and_skipped(self, tmp_path):
+        import socket
+        import time
+
+        from backplane import UnixSocketBackplane
+
+        path = str(tmp_path / "backplane.sock")
+        received = []
+        backplane = UnixSocketBackplane(path)
+        backplane.start(lambda *event: received.append(event))
+        rogue = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        rogue.connect(path)
+        try:
+            rogue.sendall(b"not json\n42\n")
+            backplane.publish("ws:lobby", "<div>after</div>")
+            for _ in range(100):
+                if received:
+                    break
+                time.sleep(0.01)
+            stats = backplane.stats()
+        finally:
+            rogue.close()
+            backplane.close()
+        assert [event[:2] for event in received] == [("ws:lobby", "<div>after</div>")]
+        assert stats["malformed"] == 2
+
+    def test_undeliverable_lines_do_not_stop_the_reader(self, tmp_path):
+        import json
+        import socket
+        import time
+
+        from backplane import UnixSocketBackplane
+
+        path = str(tmp_path / "backplane.sock")
+        received = []
+
+        def deliver(channel, data, event_id):
+            if channel == "sse:nope":
+                raise KeyError("nope")
+            received.append((channel, data))
+
+        backplane = UnixSocketBackplane(path)
+        backplane.start(deliver)
+        for _ in range(100):
+            if backplane.stats()["workers"] == 1:
+                break
+            time.sleep(0.01)
+        with backplane._clients_lock:
+            (outbox,) = backplane._clients.values()
+        for message in ([1, 2, "x"], [True, "ws:lobby", "x"], [3, "sse:nope", "x"]):
+            outbox.put_nowait((json.dumps(message) + "\n").encode("utf-8"))
+        rogue = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        rogue.connect(path)
+        try:
+            rogue.sendall(b'{"channel": "ws:lobby"}\n[1, "x"]\n')
+            backplane.publish("ws:lobby", "<div>after</div>")
+            for _ in range(100):
+                if received and backplane.stats()["malformed"] == 5:
+                    break
+                time.sleep(0.01)
+            stats = backplane.stats()
+        finally:
+            rogue.close()
+            backplane.close()
+        assert received == [("ws:lobby", "<div>after</div>")]
+        assert stats["malformed"] == 5
+        assert stats["relayed"] == 1
+
+    def test_publish_never_blocks_on_a_full_queue(self, tmp_path):
+        from backplane import UnixSocketBackplane
+
+        backplane = UnixSocketBackplane(str(tmp_path / "idle.sock"), queue_size=1)
+        backplane.publish("ws:lobby", "queued")
+        backplane.publish("ws:lobby", "dropped")
+        assert backplane.stats()["dropped"] == 1
+
+    def test_lock_holder_is_the_only_broker(self, tmp_path):
+        from backplane import UnixSocketBackplane
+
+        path = str(tmp_path / "backplane.sock")
+        workers = [UnixSocketBackplane(path) for _ in range(3)]
+        for worker in workers:
+            worker.start(lambda *event: None)
+        try:
+            assert [worker.is_broker for worker in workers] == [True, False, False]
+        finally:
+            for worker in reversed(workers):
+                worker.close()
+
+    def test_stale_socket_file_is_taken_over(self, tmp_path):
+        import socket
+
+        from backplane import UnixSocketBackplane
+
+        path = str(tmp_path / "stale.sock")
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        backplane = UnixSocketBackplane(path)
+        backplane.start(lambda *event: None)
+        try:
+            assert backplane.is_broker
+        finally:
+            backplane.close()
+
+    def test_websocket_broadcast_goes_through_backplane(self):
+        import main
+
+        before = main.backplane.stats()["published"]
+        with TestClient(app) as client:
+            with client.websocket_connect("/ws?room=plane") as ws:
+                ws.send_text("relayed")
+                assert "relayed" in ws.receive_text()
+        assert main.backplane.stats()["published"] == before + 1
@@ -0,0 +1,504 @@
+from __future__ import annotations
+
+import queue
+import sqlite3
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future
+from threading import Lock, Thread
+from typing import Any, Protocol
+
+TODO_FILTERS = ("all", "active", "done")
+
+
+Apply = Callable[[Any], Any]
+# A changed todo id with its current row, or None when it was deleted.
+Change = tuple[int, "dict[str, Any] | None"]
+_Write = tuple[Callable[[sqlite3.Connection], Any], "Apply | None", Future]
+
+
+class TodoBackend(Protocol):
+    def load(self) -> list[dict[str, Any]]: ...
+
+    def seed(self, items: list[dict[str, Any]]) -> None: ...
+
+    def replace(self, items: list[dict[str, Any]]) -> None: ...
+
+    def insert(self, text: str, apply: Apply | None = None) -> Any: ...
+
+    def toggle(self, todo_id: int, apply: Apply | None = None) -> Any: ...
+
+    def delete(self, todo_id: int, apply: Apply | None = None) -> Any: ...
+
+    def changes(self) -> list[Change] | None: ...
+
+
+def _insert_items(conn: sqlite3.Connection, items: list[dict[str, Any]]) -> None:
+    conn.executemany(
+        "INSERT INTO todos (id, text, done) VALUES (?, ?, ?)",
+        [(item["id"], item["text"], int(item["done"])) for item in items],
+    )
+
+
+class SQLiteTodoBackend:
+    """Todo persistence on SQLite in WAL mode with group commit.
+
+    Writes are queued to a single writer thread. Each loop takes every write
+    that piled up while the previous commit ran and applies the whole batch in
+    one transaction. Callers block until their batch commits. With
+    ``synchronous=NORMAL`` a WAL commit does not fsync, so the per-request cost
+    is one shared transaction.
+
+    Triggers append the id of every inserted, updated or deleted row to a
+    ``todo_changes`` log, trimmed to the last ``log_size`` entries. Reads use
+    their own connection, so they never wait on the writer. ``changes()``
+    first compares ``PRAGMA data_version``, which moves only when another
+    connection commits, and then returns just the rows changed since the
+    last ``load()`` or ``changes()``. It returns None when the log no longer
+    reaches back that far and the caller has to ``load()`` everything.
+
+    A write may carry an ``apply`` callback. The writer thread calls it with
+    the write's result right after the commit, in commit order, and the
+    caller gets its return value. A cache updated from ``apply`` therefore
+    sees writes in the same order as the database.
+    """
+
+    def __init__(self, path: str, max_batch: int = 256, log_size: int = 10_000) -> None:
+        self.max_batch = max_batch
+        self.log_size = log_size
+        self.commits = 0
+        self.writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn_lock = Lock()
+        with self._conn_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS todos ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "text TEXT NOT NULL, "
+                "done INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS todo_changes ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "id INTEGER NOT NULL)"
+            )
+            for event, row in (("INSERT", "new"), ("UPDATE", "new"), ("DELETE", "old")):
+                self._conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS todos_log_{event.lower()} "
+                    f"AFTER {event} ON todos BEGIN "
+                    f"INSERT INTO todo_changes (id) VALUES ({row}.id); END"
+                )
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._reader.execute("PRAGMA busy_timeout=5000")
+        self._reader_lock = Lock()
+        self._data_version = 0
+        self._seq = 0
+        self._queue: queue.Queue[_Write | None] = queue.Queue()
+        self._writer = Thread(target=self._run, name="todo-group-commit", daemon=True)
+        self._writer.start()
+
+    def load(self) -> list[dict[str, Any]]:
+        with self._reader_lock:
+            self._data_version = self._read_data_version()
+            self._reader.execute("BEGIN")
+            try:
+                rows = self._reader.execute(
+                    "SELECT id, text, done FROM todos ORDER BY id"
+                ).fetchall()
+                self._seq = self._reader.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM todo_changes"
+                ).fetchone()[0]
+            finally:
+                self._reader.execute("COMMIT")
+        return [{"id": row[0], "text": row[1], "done": bool(row[2])} for row in rows]
+
+    def seed(self, items: list[dict[str, Any]]) -> None:
+        """Insert ``items`` unless this database has been seeded before.
+
+        ``PRAGMA user_version`` is checked and set in the same transaction, so
+        a list emptied by its users stays empty across restarts, and workers
+        starting together seed it exactly once.
+        """
+
+        def write(conn: sqlite3.Connection) -> None:
+            if conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+                _insert_items(conn, items)
+                conn.execute("PRAGMA user_version = 1")
+
+        self._submit(write)
+
+    def replace(self, items: list[dict[str, Any]]) -> None:
+        def write(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM todos")
+            _insert_items(conn, items)
+            conn.execute("PRAGMA user_version = 1")
+
+        self._submit(write)
+
+    def insert(self, text: str, apply: Apply | None = None) -> Any:
+        return self._submit(
+            lambda conn: conn.execute("INSERT INTO todos (text, done) VALUES (?, 0)", (text,)).lastrowid,
+            apply,
+        )
+
+    def toggle(self, todo_id: int, apply: Apply | None = None) -> Any:
+        def write(conn: sqlite3.Connection) -> bool | None:
+            row = conn.execute(
+                "UPDATE todos SET done = 1 - done WHERE id = ? RETURNING done", (todo_id,)
+            ).fetchone()
+            return None if row is None else bool(row[0])
+
+        return self._submit(write, apply)
+
+    def delete(self, todo_id: int, apply: Apply | None = None) -> Any:
+        return self._submit(
+            lambda conn: conn.execute("DELETE FROM todos WHERE id = ?", (todo_id,)).rowcount > 0,
+            apply,
+        )
+
+    def changes(self) -> list[Change] | None:
+        with self._reader_lock:
+            version = self._read_data_version()
+            if version == self._data_version:
+                return []
+            self._data_version = version
+            self._reader.execute("BEGIN")
+            try:
+                oldest = self._reader.execute("SELECT MIN(seq) FROM todo_changes").fetchone()[0]
+                if oldest is not None and oldest > self._seq + 1:
+                    return None
+                rows = self._reader.execute(
+                    "SELECT c.id, MAX(c.seq), t.text, t.done FROM todo_changes AS c "
+                    "LEFT JOIN todos AS t ON t.id = c.id "
+                    "WHERE c.seq > ? GROUP BY c.id ORDER BY c.id",
+                    (self._seq,),
+                ).fetchall()
+            finally:
+                self._reader.execute("COMMIT")
+            self._seq = max((row[1] for row in rows), default=self._seq)
+        return [
+            (todo_id, None if text is None else {"id": todo_id, "text": text, "done": bool(done)})
+            for todo_id, _, text, done in rows
+        ]
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._writer.join()
+        self._conn.close()
+        self._reader.close()
+
+    def _read_data_version(self) -> int:
+        return self._reader.execute("PRAGMA data_version").fetchone()[0]
+
+    def _submit(
+        self, write: Callable[[sqlite3.Connection], Any], apply: Apply | None = None
+    ) -> Any:
+        future: Future = Future()
+        self._queue.put((write, apply, future))
+        return future.result()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: list[_Write]) -> None:
+        results: list[Any] = []
+        with self._conn_lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for write, _, _ in batch:
+                    results.append(write(self._conn))
+                self._conn.execute(
+                    "DELETE FROM todo_changes WHERE seq <= (SELECT MAX(seq) FROM todo_changes) - ?",
+                    (self.log_size,),
+                )
+                self._conn.execute("COMMIT")
+            except Exception as exc:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                for _, _, future in batch:
+                    future.set_exception(exc)
+                return
+            self.commits += 1
+            self.writes += len(batch)
+        for (_, apply, future), result in zip(batch, results):
+            try:
+                future.set_result(apply(result) if apply is not None else result)
+            except Exception as exc:
+                future.set_exception(exc)
+
+
+class _IdIndex:
+    """Set of positive ids with O(log n) updates, rank and select.
+
+    A Fenwick tree counts members by id. ``rank(id)`` is a prefix sum and
+    ``select(k)`` finds the k-th smallest member by binary lifting. The tree
+    doubles its capacity when an id outgrows it.
+    """
+
+    def __init__(self, ids: Iterable[int] = ()) -> None:
+        self._members = set(ids)
+        self._build(max(self._members, default=0))
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __contains__(self, todo_id: int) -> bool:
+        return todo_id in self._members
+
+    def add(self, todo_id: int) -> None:
+        if todo_id in self._members:
+            return
+        self._members.add(todo_id)
+        if todo_id >= len(self._tree):
+            self._build(todo_id * 2)
+        else:
+            self._update(todo_id, 1)
+
+    def discard(self, todo_id: int) -> None:
+        if todo_id in self._members:
+            self._members.remove(todo_id)
+            self._update(todo_id, -1)
+
+    def rank(self, todo_id: int) -> int:
+        """Number of members less than or equal to ``todo_id``."""
+        i = min(todo_id, len(self._tree) - 1)
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def select(self, k: int) -> int:
+        """The ``k``-th smallest member, counting from 1."""
+        pos = 0
+        step = self._size
+        while step:
+            if pos + step <= self._size and self._tree[pos + step] < k:
+                pos += step
+                k -= self._tree[pos]
+            step //= 2
+        return pos + 1
+
+    def _build(self, capacity: int) -> None:
+        size = 1
+        while size < capacity:
+            size *= 2
+        tree = [0] * (size + 1)
+        for todo_id in self._members:
+            tree[todo_id] += 1
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._size = size
+        self._tree = tree
+
+    def _update(self, i: int, delta: int) -> None:
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+
+class TodoStore:
+    """Id-indexed todo list that keeps insertion order for rendering.
+
+    Todos live in a dict keyed by id, so lookups are O(1). Ids are handed out
+    in increasing order, and each filter keeps an ``_IdIndex`` (a Fenwick
+    tree), so adds, toggles and deletes are O(log n). Keyset pagination is a
+    rank for the cursor plus one select per row.
+
+    With a ``backend`` the store acts as a read cache: the backend's writer
+    applies each write in memory right after it commits, in commit order, and
+    reads first apply the rows other processes changed (``changes()``), at
+    O(log n) per row. Only when the backend's change log has been trimmed past
+    the store's position does a read reload everything.
+    ``items`` only seed a backend that has never been seeded. ``revision``
+    moves on every change.
+    """
+
+    def __init__(
+        self,
+        items: Iterable[dict[str, Any]] = (),
+        backend: TodoBackend | None = None,
+    ) -> None:
+        self.lock = Lock()
+        self.revision = 0
+        self._backend = backend
+        self._items: dict[int, dict[str, Any]] = {}
+        self._index: dict[str, _IdIndex] = {name: _IdIndex() for name in TODO_FILTERS}
+        self.next_id = 1
+        if backend is None:
+            self.reset(items)
+            return
+        backend.seed(sorted((dict(item) for item in items), key=lambda item: item["id"]))
+        with self.lock:
+            self._load(backend.load())
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        return iter(self.all())
+
+    def all(self) -> list[dict[str, Any]]:
+        with self.lock:
+            self._sync()
+            return [self._items[todo_id] for todo_id in sorted(self._items)]
+
+    def refresh(self) -> int:
+        with self.lock:
+            self._sync()
+            return self.revision
+
+    def counts(self) -> dict[str, int]:
+        with self.lock:
+            self._sync()
+            return {
+                "total": len(self._items),
+                "active": len(self._index["active"]),
+                "done": len(self._index["done"]),
+            }
+
+    def last_id(self) -> int:
+        with self.lock:
+            self._sync()
+            return self.next_id - 1
+
+    def page(
+        self,
+        status: str = "all",
+        after: int = 0,
+        until: int | None = None,
+        limit: int = 50,
+    ) -> tuple[list[dict[str, Any]], int | None]:
+        with self.lock:
+            self._sync()
+            index = self._index[status]
+            start = index.rank(after)
+            stop = len(index) if until is None else index.rank(until)
+            chunk = [index.select(k) for k in range(start + 1, min(start + limit, stop) + 1)]
+            todos = [self._items[todo_id] for todo_id in chunk]
+        next_cursor = chunk[-1] if chunk and start + len(chunk) < stop else None
+        return todos, next_cursor
+
+    def get(self, todo_id: int) -> dict[str, Any] | None:
+        with self.lock:
+            self._sync()
+            return self._items.get(todo_id)
+
+    def add(self, text: str) -> dict[str, Any]:
+        if self._backend is not None:
+            return self._backend.insert(text, lambda todo_id: self._apply_add(todo_id, text))
+        return self._apply_add(None, text)
+
+    def toggle(self, todo_id: int) -> dict[str, Any] | None:
+        if self._backend is not None:
+            return self._backend.toggle(todo_id, lambda done: self._apply_toggle(todo_id, done))
+        return self._apply_toggle(todo_id, None)
+
+    def delete(self, todo_id: int) -> dict[str, Any] | None:
+        if self._backend is not None:
+            return self._backend.delete(
+                todo_id, lambda deleted: self._apply_delete(todo_id) if deleted else None
+            )
+        return self._apply_delete(todo_id)
+
+    def reset(self, items: Iterable[dict[str, Any]]) -> None:
+        ordered = sorted((dict(item) for item in items), key=lambda item: item["id"])
+        if self._backend is not None:
+            self._backend.replace(ordered)
+        with self.lock:
+            self._load(ordered)
+
+    def _apply_add(self, todo_id: int | None, text: str) -> dict[str, Any]:
+        with self.lock:
+            if todo_id is None:
+                todo_id = self.next_id
+            elif todo_id in self._items:
+                return self._items[todo_id]
+            return self._upsert({"id": todo_id, "text": text, "done": False})
+
+    def _apply_toggle(self, todo_id: int, done: bool | None) -> dict[str, Any] | None:
+        if self._backend is not None and done is None:
+            return None
+        with self.lock:
+            todo = self._items.get(todo_id)
+            if todo is None:
+                self._sync()
+                return self._items.get(todo_id)
+            if done is None:
+                done = not todo["done"]
+            return self._upsert({**todo, "done": done})
+
+    def _apply_delete(self, todo_id: int) -> dict[str, Any] | None:
+        with self.lock:
+            todo = self._remove(todo_id)
+            if todo is None:
+                return {"id": todo_id} if self._backend is not None else None
+            return todo
+
+    def _upsert(self, row: dict[str, Any]) -> dict[str, Any]:
+        todo_id = row["id"]
+        todo = self._items.get(todo_id)
+        if todo == row:
+            return todo
+        if todo is None:
+            todo = self._items[todo_id] = dict(row)
+            self._index["all"].add(todo_id)
+            self.next_id = max(self.next_id, todo_id + 1)
+        else:
+            self._index["done" if todo["done"] else "active"].discard(todo_id)
+            todo.update(row)
+        self._index["done" if todo["done"] else "active"].add(todo_id)
+        self.revision += 1
+        return todo
+
+    def _remove(self, todo_id: int) -> dict[str, Any] | None:
+        todo = self._items.pop(todo_id, None)
+        if todo is not None:
+            self._index["all"].discard(todo_id)
+            self._index["done" if todo["done"] else "active"].discard(todo_id)
+            self.revision += 1
+        return todo
+
+    def _sync(self) -> None:
+        if self._backend is None:
+            return
+        changes = self._backend.changes()
+        if changes is None:
+            self._load(self._backend.load())
+            return
+        for todo_id, row in changes:
+            if row is None:
+                self._remove(todo_id)
+            else:
+                self._upsert(row)
+
+    def _load(self, ordered: list[dict[str, Any]]) -> None:
+        self._items = {item["id"]: item for item in ordered}
+        self._index = {
+            "all": _IdIndex(item["id"] for item in ordered),
+            "active": _IdIndex(item["id"] for item in ordered if not item["done"]),
+            "done": _IdIndex(item["id"] for item in ordered if item["done"]),
+        }
+        self.next_id = max(self._items, default=0) + 1
+        self.revision += 1
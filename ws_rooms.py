@@ -0,0 +1,365 @@
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+import zlib
+from collections.abc import Awaitable, Callable
+from html.parser import HTMLParser
+from typing import Literal
+
+SlowConsumerPolicy = Literal["drop", "disconnect"]
+TRAFFIC_COUNTERS = ("frames", "messages", "frame_bytes", "sent_bytes", "deflate_in", "deflate_out")
+# The settings websockets (uvicorn's default) negotiates: about 32 KiB of zlib state.
+DEFLATE_WBITS = 12
+DEFLATE_MEM_LEVEL = 5
+_APPEND_WRAPPER = re.compile(r'(<div id="[^"]+" hx-swap-oob="beforeend">)(.*)</div>', re.DOTALL)
+_VOID_ELEMENTS = frozenset(
+    "area base br col embed hr img input link meta source track wbr".split()
+)
+
+
+class _TopLevelOob(HTMLParser):
+    """Records the source spans of top-level elements carrying ``hx-swap-oob``."""
+
+    def __init__(self, markup: str) -> None:
+        super().__init__(convert_charrefs=False)
+        self.markup = markup
+        self.spans: list[tuple[int, int]] = []
+        self._line_starts = [0]
+        for line in markup.splitlines(keepends=True):
+            self._line_starts.append(self._line_starts[-1] + len(line))
+        self._depth = 0
+        self._start = 0
+        self._oob = False
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self._line_starts[line - 1] + column
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if self._depth == 0:
+            self._start = self._offset()
+            self._oob = any(name == "hx-swap-oob" for name, _ in attrs)
+        if tag in _VOID_ELEMENTS:
+            self._close(self._offset() + len(self.get_starttag_text() or ""))
+        else:
+            self._depth += 1
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if self._depth == 0:
+            self._start = self._offset()
+            self._oob = any(name == "hx-swap-oob" for name, _ in attrs)
+        self._close(self._offset() + len(self.get_starttag_text() or ""))
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in _VOID_ELEMENTS or self._depth == 0:
+            return
+        self._depth -= 1
+        self._close(self.markup.index(">", self._offset()) + 1)
+
+    def _close(self, end: int) -> None:
+        if self._depth == 0 and self._oob:
+            self.spans.append((self._start, end))
+            self._oob = False
+
+
+def coalesce(frames: list[str]) -> str:
+    """Join frames into one message, merging runs of ``beforeend`` wrappers on one target.
+
+    The ws extension swaps every top-level OOB element of a message, so
+    frames can simply be concatenated. Adjacent appends to the same target
+    keep a single wrapper around all of their fragments. A frame with more
+    OOB elements after its wrapper is left as it is.
+    """
+    parts: list[str] = []
+    open_wrapper = ""
+    for frame in frames:
+        match = _APPEND_WRAPPER.fullmatch(frame)
+        if match is None or "hx-swap-oob" in match.group(2):
+            if open_wrapper:
+                parts.append("</div>")
+                open_wrapper = ""
+            parts.append(frame)
+            continue
+        wrapper, inner = match.groups()
+        if wrapper != open_wrapper:
+            if open_wrapper:
+                parts.append("</div>")
+            parts.append(wrapper)
+            open_wrapper = wrapper
+        parts.append(inner)
+    if open_wrapper:
+        parts.append("</div>")
+    return "".join(parts)
+
+
+def split_oob(markup: str) -> tuple[str, str]:
+    """Split ``markup`` into its content and its top-level ``hx-swap-oob`` elements.
+
+    The ws extension only swaps top-level elements of a message out of band,
+    so OOB elements of a response that gets wrapped for a target must be
+    moved next to the wrapper rather than nested inside it.
+    """
+    parser = _TopLevelOob(markup)
+    parser.feed(markup)
+    parser.close()
+    content: list[str] = []
+    oob: list[str] = []
+    position = 0
+    for start, end in parser.spans:
+        content.append(markup[position:start])
+        oob.append(markup[start:end])
+        position = end
+    content.append(markup[position:])
+    return "".join(content), "".join(oob)
+
+
+class Connection:
+    """One WebSocket peer with a bounded outbound queue.
+
+    ``send`` never awaits. Frames are queued and a single ``pump`` task per
+    connection writes them to the socket, so a slow peer only backs up its
+    own queue. When the queue is full, ``policy`` either drops the oldest
+    frame or closes the connection as a slow consumer.
+
+    A write that does not finish within ``send_timeout`` closes the
+    connection. That only catches a peer that stops reading once the socket
+    buffers are full; a vanished peer is found by the server's protocol-level
+    ping (uvicorn's ``--ws-ping-interval`` and ``--ws-ping-timeout``).
+    Inbound messages are limited by a token bucket of ``burst`` tokens
+    refilled at ``rate`` per second (see ``allow``).
+
+    With a ``coalesce_window`` the pump waits that long after the first
+    frame and sends everything queued meanwhile as one message (see
+    ``coalesce``). With ``deflate`` each message is also run through a
+    per-connection raw deflate stream with the server's window and memory
+    settings, the way permessage-deflate with context takeover would
+    compress it, to report what compression saves.
+    ``traffic`` counts frames, messages and bytes.
+
+    ``closed`` is set once, and ``close_reason`` keeps the first reason.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        queue_size: int = 64,
+        policy: SlowConsumerPolicy = "drop",
+        rate: float = 10.0,
+        burst: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+        coalesce_window: float = 0.0,
+        deflate: bool = False,
+    ) -> None:
+        self.rooms: set[str] = set()
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self.policy = policy
+        self.dropped = 0
+        self.throttled = 0
+        self.closed = asyncio.Event()
+        self.close_reason: str | None = None
+        self.coalesce_window = coalesce_window
+        self.traffic = dict.fromkeys(TRAFFIC_COUNTERS, 0)
+        self._deflater = (
+            zlib.compressobj(wbits=-DEFLATE_WBITS, memLevel=DEFLATE_MEM_LEVEL) if deflate else None
+        )
+        self._send = send
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._clock = clock
+        self._refilled = clock()
+
+    def send(self, frame: str) -> bool:
+        if self.closed.is_set():
+            return False
+        if not self.queue.full():
+            self.queue.put_nowait(frame)
+            return True
+        if self.policy == "disconnect":
+            self.close("slow_consumer")
+            return False
+        self.queue.get_nowait()
+        self.queue.put_nowait(frame)
+        self.dropped += 1
+        return True
+
+    def allow(self) -> bool:
+        now = self._clock()
+        self._tokens = min(self._burst, self._tokens + (now - self._refilled) * self._rate)
+        self._refilled = now
+        if self._tokens < 1:
+            self.throttled += 1
+            return False
+        self._tokens -= 1
+        return True
+
+    def close(self, reason: str) -> None:
+        if not self.closed.is_set():
+            self.close_reason = reason
+            self.closed.set()
+
+    async def pump(self, send_timeout: float | None = None) -> None:
+        while not self.closed.is_set():
+            frame = await self.queue.get()
+            frames = [frame]
+            if self.coalesce_window > 0:
+                await asyncio.sleep(self.coalesce_window)
+                while not self.queue.empty():
+                    frames.append(self.queue.get_nowait())
+            message = coalesce(frames) if len(frames) > 1 else frame
+            try:
+                await asyncio.wait_for(self._send(message), send_timeout)
+            except TimeoutError:
+                self.close("send_timeout")
+            except Exception:
+                self.close("send_failed")
+            else:
+                self._count(frames, message)
+
+    def _count(self, frames: list[str], message: str) -> None:
+        payload = message.encode("utf-8")
+        self.traffic["frames"] += len(frames)
+        self.traffic["messages"] += 1
+        self.traffic["frame_bytes"] += sum(len(frame.encode("utf-8")) for frame in frames)
+        self.traffic["sent_bytes"] += len(payload)
+        if self._deflater is not None:
+            deflated = self._deflater.compress(payload) + self._deflater.flush(zlib.Z_SYNC_FLUSH)
+            # permessage-deflate drops the 00 00 ff ff tail of each sync flush.
+            self.traffic["deflate_in"] += len(payload)
+            self.traffic["deflate_out"] += len(deflated) - 4
+
+
+class RoomHub:
+    """Named WebSocket rooms with server-side broadcast.
+
+    A broadcast is rendered by the caller once and the same frame object is
+    queued on every member of the room. Fan-out is a loop of non-blocking
+    ``Connection.send`` calls, so it never waits on a socket. Connections
+    are created with the hub's queue, policy and rate settings, and
+    ``disconnect`` counts each connection under its close reason.
+
+    With ``measure_deflate``, one in ``deflate_sample`` connections that
+    negotiated permessage-deflate gets a metrics deflate stream, so the
+    ``deflate_*`` counters cover a sample and the extra memory stays small.
+
+    Queues belong to the event loop. ``broadcast_threadsafe`` hands frames
+    from other threads (the backplane reader) to the loop.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = 64,
+        policy: SlowConsumerPolicy = "drop",
+        rate: float = 10.0,
+        burst: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+        coalesce_window: float = 0.0,
+        measure_deflate: bool = False,
+        deflate_sample: int = 1,
+    ) -> None:
+        self.queue_size = queue_size
+        self.policy = policy
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_window = coalesce_window
+        self.measure_deflate = measure_deflate
+        self.deflate_sample = max(1, deflate_sample)
+        self._deflate_offers = 0
+        self._clock = clock
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._rooms: dict[str, set[Connection]] = {}
+        self._connections: set[Connection] = set()
+        self._stats = {"broadcasts": 0, "delivered": 0, "dropped": 0, "throttled": 0}
+        self._closed: dict[str, int] = {}
+        self._traffic = dict.fromkeys(TRAFFIC_COUNTERS, 0)
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def connect(
+        self, send: Callable[[str], Awaitable[None]], deflate: bool = False
+    ) -> Connection:
+        """Register a peer. ``deflate`` says the peer uses permessage-deflate."""
+        self._loop = asyncio.get_running_loop()
+        measure = False
+        if deflate and self.measure_deflate:
+            measure = self._deflate_offers % self.deflate_sample == 0
+            self._deflate_offers += 1
+        connection = Connection(
+            send,
+            self.queue_size,
+            self.policy,
+            self.rate,
+            self.burst,
+            self._clock,
+            self.coalesce_window,
+            measure,
+        )
+        self._connections.add(connection)
+        return connection
+
+    def disconnect(self, connection: Connection) -> None:
+        if connection not in self._connections:
+            return
+        for room in list(connection.rooms):
+            self.leave(connection, room)
+        self._connections.discard(connection)
+        connection.close("server_closed")
+        reason = connection.close_reason or "server_closed"
+        self._closed[reason] = self._closed.get(reason, 0) + 1
+        self._stats["dropped"] += connection.dropped
+        self._stats["throttled"] += connection.throttled
+        for name, value in connection.traffic.items():
+            self._traffic[name] += value
+
+    def join(self, connection: Connection, room: str) -> None:
+        self._rooms.setdefault(room, set()).add(connection)
+        connection.rooms.add(room)
+
+    def leave(self, connection: Connection, room: str) -> None:
+        members = self._rooms.get(room)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del self._rooms[room]
+        connection.rooms.discard(room)
+
+    def members(self, room: str) -> int:
+        return len(self._rooms.get(room, ()))
+
+    def broadcast(self, room: str, frame: str) -> int:
+        members = list(self._rooms.get(room, ()))
+        self._stats["broadcasts"] += 1
+        delivered = sum(connection.send(frame) for connection in members)
+        self._stats["delivered"] += delivered
+        return delivered
+
+    def broadcast_threadsafe(self, room: str, frame: str) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self.broadcast(room, frame)
+        else:
+            loop.call_soon_threadsafe(self.broadcast, room, frame)
+
+    def stats(self) -> dict[str, int | str | dict[str, int]]:
+        return {
+            **self._stats,
+            "dropped": self._stats["dropped"] + sum(c.dropped for c in self._connections),
+            "throttled": self._stats["throttled"] + sum(c.throttled for c in self._connections),
+            "rooms": len(self._rooms),
+            "connections": len(self._connections),
+            "policy": self.policy,
+            "closed": dict(self._closed),
+            "traffic": self.traffic(),
+        }
+
+    def traffic(self) -> dict[str, int]:
+        totals = dict(self._traffic)
+        for connection in self._connections:
+            for name, value in connection.traffic.items():
+                totals[name] += value
+        totals["coalesce_saved_bytes"] = totals["frame_bytes"] - totals["sent_bytes"]
+        totals["deflate_saved_bytes"] = totals["deflate_in"] - totals["deflate_out"]
+        return totals